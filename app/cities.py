@@ -0,0 +1,153 @@
+import difflib
+import re
+import threading
+import time
+
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from .config import CITY_PLACEHOLDERS, CITY_FUZZY_CUTOFF, logger
+from .database import (load_city_aliases, load_city_coordinates, get_employee_cities, set_employee_city_ids,
+                       get_sync_state, set_sync_state)
+from .gazetteer import gazetteer_key, gazetteer_names
+
+# Разделители нескольких мест в одном поле: «Орехово-Зуево, Московская обл.», «Пермь/Санкт-Петербург», «Электросталь (МО)»
+PARTS_RE = re.compile(r'[,/;()]')
+
+# Тип населённого пункта перед названием: «г. Петергоф», «пос. Мурино»
+PREFIX_RE = re.compile(r'^\s*(г|гор|город|пгт|пос|поселок|посёлок|село|деревня|city of)\b\.?\s*', re.IGNORECASE)
+
+# Части адреса, которые не являются городом (проверяются по ключу gazetteer_key): регион, район, страна
+REGION_RE = re.compile(
+    r'\b(обл|область|край|респ|республика|район|р н|округ|ао|мо|ло|oblast|region|krai|district)\b'
+    r'|^(россия|рф|russia|сербия|srbija|serbia|беларусь|белоруссия|belarus|казахстан|kazakhstan|узбекистан|uzbekistan'
+    r'|кыргызстан|киргизия|kyrgyzstan|армения|armenia|грузия|georgia|азербайджан|azerbaijan|черногория|montenegro'
+    r'|украина|ukraine|молдова|moldova|таджикистан|tajikistan|туркменистан|turkmenistan)$'
+)
+
+# Ключ версии индекса городов в sync_state: меняется при изменении синонимов и координат,
+# по нему процессы (API и воркеры) понимают, что индекс нужно собрать заново
+CITY_INDEX_VERSION = "city_index_version"
+
+# Слова не длиннее этого считаются сокращениями («н», «ст») и совпадают только с началом слова названия
+ABBREVIATION_MAX_LEN = 2
+
+# Индекс известных городов: ключ -> город; ключи нечёткого поиска сгруппированы по первой букве
+_known: Dict[str, str] = {}
+_fuzzy_buckets: Dict[str, List[str]] = {}
+_loaded = False
+_version: Optional[str] = None
+_lock = threading.Lock()
+
+
+def load_city_index():
+    """Сборка индекса городов: справочник, города с координатами и синонимы из базы"""
+    global _known, _fuzzy_buckets, _loaded, _version
+    version = get_sync_state(CITY_INDEX_VERSION)
+    known = dict(gazetteer_names())
+    for city in load_city_coordinates():
+        known.setdefault(gazetteer_key(city), city)
+    aliases = load_city_aliases()
+    for city in aliases.values():
+        known.setdefault(gazetteer_key(city), city)
+    # Синонимы важнее справочника: их задают вручную
+    known.update(aliases)
+    buckets = {}
+    for key in known:
+        buckets.setdefault(key[:1], []).append(key)
+    with _lock:
+        _known, _fuzzy_buckets, _loaded, _version = known, buckets, True, version
+        normalize_city.cache_clear()
+    logger.info(f"Индекс городов: {len(known)} названий, {len(aliases)} синонимов")
+
+
+def refresh_city_index() -> bool:
+    """Пересборка индекса, если синонимы или координаты изменил другой процесс; возвращает True, если индекс собран заново"""
+    if _loaded and get_sync_state(CITY_INDEX_VERSION) == _version:
+        return False
+    load_city_index()
+    return True
+
+
+def reload_city_index():
+    """Новая версия индекса (после изменения синонимов или координат) и его пересборка в текущем процессе"""
+    set_sync_state(CITY_INDEX_VERSION, str(time.time_ns()))
+    load_city_index()
+
+
+def _is_abbreviation(token: str) -> bool:
+    """Сокращённое слово названия: «Н.» в «Н. Новгород», «Ст.» в «Ст. Оскол»"""
+    return len(token) <= ABBREVIATION_MAX_LEN
+
+
+def _compatible(key: str, candidate: str) -> bool:
+    """Ключ может означать этот город: столько же слов, а сокращённые слова — начала слов названия
+
+    Без этой проверки «н новгород» нечётко совпадает с «новгород» (Великий Новгород).
+    """
+    key_tokens, candidate_tokens = key.split(), candidate.split()
+    return len(key_tokens) == len(candidate_tokens) and all(
+        candidate_token.startswith(token) for token, candidate_token in zip(key_tokens, candidate_tokens)
+        if _is_abbreviation(token))
+
+
+def _match(key: str) -> Optional[str]:
+    """Точное совпадение, раскрытие сокращений, затем нечёткое совпадение ключа с известными городами"""
+    if key in _known:
+        return _known[key]
+    bucket = _fuzzy_buckets.get(key[:1], [])
+    if any(_is_abbreviation(token) for token in key.split()):
+        # «н новгород» -> «нижний новгород»: остальные слова совпадают точно, сокращение однозначно
+        expansions = {_known[candidate] for candidate in bucket
+                      if _compatible(key, candidate) and all(
+                          _is_abbreviation(token) or token == candidate_token
+                          for token, candidate_token in zip(key.split(), candidate.split()))}
+        if len(expansions) == 1:
+            return expansions.pop()
+    for match in difflib.get_close_matches(key, bucket, n=5, cutoff=CITY_FUZZY_CUTOFF):
+        if _compatible(key, match):
+            logger.debug(f"Город '{key}' сопоставлен с '{_known[match]}'")
+            return _known[match]
+    return None
+
+
+@lru_cache(maxsize=4096)
+def normalize_city(city: Optional[str]) -> Optional[str]:
+    """Идентификатор города (основное название) для значения поля «Город проживания»; None, если город не указан"""
+    if not city or city.strip() in CITY_PLACEHOLDERS:
+        return None
+    if not _loaded:
+        load_city_index()
+    key = gazetteer_key(city)
+    if not key:
+        # Пробелы или одни знаки препинания — город не указан
+        return None
+    if key in _known:
+        return _known[key]
+
+    # Поле может содержать несколько мест; регион и страну отбрасываем
+    candidates = []
+    for part in PARTS_RE.split(city):
+        part = PREFIX_RE.sub('', part).strip()
+        part_key = gazetteer_key(part)
+        if part_key and not REGION_RE.search(part_key):
+            candidates.append((part, part_key))
+    for _, part_key in candidates:
+        if part_key in _known:
+            return _known[part_key]
+    for _, part_key in candidates:
+        match = _match(part_key)
+        if match:
+            return match
+    # Неизвестный город оставляем как есть (без региона): его найдёт геокодер
+    return candidates[0][0] if candidates else city.strip()
+
+
+def renormalize_employees(only_missing: bool = False) -> int:
+    """Пересчёт city_id сотрудников (после изменения синонимов); возвращает количество изменённых строк"""
+    changed = [(normalize_city(city), user_id) for user_id, city, city_id in get_employee_cities(only_missing)
+               if normalize_city(city) != city_id]
+    set_employee_city_ids(changed)
+    if changed:
+        logger.info(f"Обновлён город у {len(changed)} сотрудников")
+    return len(changed)
@@ -0,0 +1,74 @@
+import bisect
+import math
+
+from typing import Dict, List, Optional, Tuple
+
+from .config import CLUSTER_GRID_SIZE, CLUSTER_MAX_ZOOM
+
+# Размер тайла карты в пикселях (веб-Меркатор, как у Яндекс Карт и OSM)
+TILE_SIZE = 256
+
+# Широта, дальше которой проекция Меркатора не определена
+MAX_LATITUDE = 85.05112878
+
+
+def world_pixel(coordinates: List[float], zoom: int) -> Tuple[float, float]:
+    """Координаты [lat, lon] в пикселях мировой карты на уровне zoom"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, coordinates[0]))
+    scale = TILE_SIZE * 2 ** zoom
+    x = (coordinates[1] + 180) / 360 * scale
+    sin_lat = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def _cluster(markers: List[dict]) -> dict:
+    """Кластер из маркеров одной ячейки сетки: центр взвешен по числу сотрудников"""
+    if len(markers) == 1:
+        marker = markers[0]
+        return {'coordinates': marker['coordinates'], 'count': marker['count'], 'cities': 1,
+                'city': marker['city'], 'version': marker['version']}
+    count = sum(marker['count'] for marker in markers)
+    lats = [marker['coordinates'][0] for marker in markers]
+    lons = [marker['coordinates'][1] for marker in markers]
+    return {
+        'coordinates': [sum(marker['coordinates'][0] * marker['count'] for marker in markers) / count,
+                        sum(marker['coordinates'][1] * marker['count'] for marker in markers) / count],
+        'count': count,
+        'cities': len(markers),
+        # По границам клиент приближает карту при клике на кластер
+        'bounds': [[min(lats), min(lons)], [max(lats), max(lons)]]
+    }
+
+
+def build_clusters(markers: List[dict]) -> Dict[int, List[dict]]:
+    """Кластеры маркеров для каждого уровня масштаба 0..CLUSTER_MAX_ZOOM
+
+    Маркеры группируются по ячейкам сетки CLUSTER_GRID_SIZE пикселей на данном масштабе;
+    кластеры каждого уровня отсортированы по долготе для поиска по bbox.
+    """
+    clusters = {}
+    for zoom in range(CLUSTER_MAX_ZOOM + 1):
+        cells = {}
+        for marker in markers:
+            x, y = world_pixel(marker['coordinates'], zoom)
+            cells.setdefault((int(x // CLUSTER_GRID_SIZE), int(y // CLUSTER_GRID_SIZE)), []).append(marker)
+        clusters[zoom] = sorted((_cluster(cell) for cell in cells.values()), key=lambda c: c['coordinates'][1])
+    return clusters
+
+
+def clusters_in_bbox(clusters: List[dict], south: float, west: float, north: float, east: float,
+                     lons: Optional[List[float]] = None) -> List[dict]:
+    """Кластеры уровня, попадающие в bbox (west > east — область пересекает 180-й меридиан)
+
+    lons — отсортированные долготы кластеров, чтобы не собирать их на каждый запрос.
+    """
+    if lons is None:
+        lons = [cluster['coordinates'][1] for cluster in clusters]
+    ranges = [(west, east)] if west <= east else [(west, 180), (-180, east)]
+    result = []
+    for low, high in ranges:
+        for cluster in clusters[bisect.bisect_left(lons, low):bisect.bisect_right(lons, high)]:
+            if south <= cluster['coordinates'][0] <= north:
+                result.append(cluster)
+    return result
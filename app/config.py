@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 from .logger import get_logger
 
@@ -6,6 +7,33 @@ load_dotenv()
 
 REDMINE_URL = "https://tasks.fut.ru"
 
+# Количество одновременных запросов к Redmine при импорте
+REDMINE_CONCURRENCY = int(os.getenv("REDMINE_CONCURRENCY", "10"))
+
+# Таймаут запроса к Redmine в секундах
+REDMINE_TIMEOUT = float(os.getenv("REDMINE_TIMEOUT", "10"))
+
+# Максимальная скорость запросов к Redmine (запросов в секунду)
+REDMINE_RATE_LIMIT = float(os.getenv("REDMINE_RATE_LIMIT", "20"))
+
+# Политика Nominatim: не больше одного запроса в секунду
+NOMINATIM_RATE_LIMIT = 1.0
+
+# Максимальная скорость запросов к Google Sheets (запросов в секунду)
+SHEETS_RATE_LIMIT = float(os.getenv("SHEETS_RATE_LIMIT", "1"))
+
+# Количество повторов при ответах 429/503
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+
+# Размер страницы /users.json (Redmine отдаёт не больше 100 записей)
+REDMINE_PAGE_SIZE = 100
+
+# Корпоративный домен почты сотрудников
+CORPORATE_DOMAIN = "@futuretoday.ru"
+
+# Сколько секунд не перепроверять ID, отклонённые при импорте (404, заблокирован, не корпоративный)
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", str(7 * 24 * 3600)))
+
 API_KEY = os.getenv("API_KEY")
 
 PASSWORD = os.getenv("PASSWORD")
@@ -14,14 +42,110 @@ ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 
 DB_PATH = "users.db"
 
+# Сколько секунд соединение SQLite ждёт освобождения блокировки записи
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+
+# Размер кэша страниц SQLite на соединение, КиБ
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+# Сколько байт файла базы читать через mmap
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Сколько подготовленных запросов хранить на соединение
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+
+# Посещения карты копятся в памяти и пишутся в базу пачками: по размеру пачки или раз в VISIT_FLUSH_INTERVAL секунд
+VISIT_BATCH_SIZE = int(os.getenv("VISIT_BATCH_SIZE", "500"))
+VISIT_FLUSH_INTERVAL = float(os.getenv("VISIT_FLUSH_INTERVAL", "2"))
+
+# Сколько посещений держать в буфере, если база не успевает (самые старые отбрасываются)
+VISIT_BUFFER_SIZE = int(os.getenv("VISIT_BUFFER_SIZE", "100000"))
+
+# Сколько потоков выполняют чтения из базы для асинхронного кода (запись всегда в одном потоке)
+DB_READ_WORKERS = int(os.getenv("DB_READ_WORKERS", "4"))
+
+# Сколько секунд считать координаты города из геокодера актуальными
+GEOCODE_TTL = int(os.getenv("GEOCODE_TTL", str(90 * 24 * 3600)))
+
+# Через сколько секунд повторять поиск города, не найденного геокодером
+GEOCODE_MISS_TTL = int(os.getenv("GEOCODE_MISS_TTL", str(24 * 3600)))
+
+# Офлайн-справочник городов (Россия, СНГ, Сербия), по нему координаты ищутся до обращения к геокодеру
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(__file__), "data", "gazetteer.tsv"))
+
+# Искать в Nominatim города, которых нет в справочнике (0 — сборка карты полностью без сети)
+NOMINATIM_ENABLED = os.getenv("NOMINATIM_ENABLED", "1") == "1"
+
+# Сколько раз в фоне повторять запрос города, если геокодер был недоступен
+GEOCODE_RETRY_ATTEMPTS = int(os.getenv("GEOCODE_RETRY_ATTEMPTS", "5"))
+
+# Базовая пауза перед фоновым повтором, секунды (растёт экспоненциально)
+GEOCODE_RETRY_DELAY = float(os.getenv("GEOCODE_RETRY_DELAY", "60"))
+
+# Заданные вручную координаты (не запрашиваются у геокодера и не устаревают)
+CITY_COORDINATE_OVERRIDES = {
+    "Москва": [55.778487, 37.672379],
+}
+
+# Начальная таблица синонимов городов (написание в Redmine -> город); дополняется через админку
+CITY_ALIASES = {
+    "Санкт Петербург": "Санкт-Петербург",
+    "г. Петергоф, г. Санкт-Петербург": "Санкт-Петербург",
+    "Пермь/Санкт-Петербург": "Санкт-Петербург",
+    "Электросталь (МО)": "Электросталь",
+    "Орехово-Зуево, Московская обл.": "Орехово-Зуево",
+    "Пушкино, Московская область": "Пушкино",
+    "Белград, Сербия": "Белград",
+    "Нови Сад, Сербия": "Нови Сад",
+}
+
+# Значения поля «Город проживания», которые означают, что город не указан
+CITY_PLACEHOLDERS = ["No city", "Ввести город", "Город проживания"]
+
+# Минимальное сходство (0..1) для нечёткого сопоставления города с известными названиями
+CITY_FUZZY_CUTOFF = float(os.getenv("CITY_FUZZY_CUTOFF", "0.85"))
+
+# Размер ячейки сетки кластеризации маркеров в пикселях экрана
+CLUSTER_GRID_SIZE = int(os.getenv("CLUSTER_GRID_SIZE", "64"))
+
+# Максимальный масштаб, для которого заранее считаются кластеры (на больших масштабах берётся он)
+CLUSTER_MAX_ZOOM = int(os.getenv("CLUSTER_MAX_ZOOM", "16"))
+
+# Размер пачки при записи сотрудников в базу
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "100"))
+
 GOOGLE_SHEET_KEY = os.getenv("GOOGLE_SHEET_KEY")
 
 CREDENTIALS_FILE = "credentials.json"
 
+# Не скачивать таблицу, если она и список сотрудников не менялись с прошлого обновления
+SHEETS_SKIP_UNCHANGED = os.getenv("SHEETS_SKIP_UNCHANGED", "1") == "1"
+
 REDIS_HOST = "localhost"
 
 REDIS_PORT = 6379
 
+# Где выполнять фоновые задачи: redis (очередь + отдельный воркер python -m app.worker) или local (в процессе API)
+JOB_BACKEND = os.getenv("JOB_BACKEND", "redis")
+
+# Сколько задач воркер выполняет одновременно
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+
+# Идентификатор воркера (уникальный для каждого процесса); задачи, прерванные его рестартом, возвращаются в очередь
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+
+# Срок аренды воркера в секундах: если воркер не продлил её, его незаконченные задачи забирает любой другой воркер
+JOB_LEASE_TTL = int(os.getenv("JOB_LEASE_TTL", "30"))
+
+# Сколько раз задача запускается заново после падения воркера, прежде чем получить статус failed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Сколько секунд хранить прогресс и статус завершённых задач
+JOB_TTL = int(os.getenv("JOB_TTL", "3600"))
+
+# Как часто (секунды) задача отправляет прогресс в Redis и подписчикам
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "0.5"))
+
 logger = get_logger()
 
 if not API_KEY:
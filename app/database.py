@@ -1,10 +1,71 @@
+import asyncio
+import json
+import re
 import sqlite3
-from .config import DB_PATH, logger, REDMINE_URL
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, List
+
+from .config import (DB_PATH, logger, REDMINE_URL, CORPORATE_DOMAIN, NEGATIVE_CACHE_TTL, DB_BATCH_SIZE, GEOCODE_TTL,
+                     GEOCODE_MISS_TTL, CITY_COORDINATE_OVERRIDES, CITY_ALIASES, SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE_KB,
+                     SQLITE_MMAP_SIZE, SQLITE_CACHED_STATEMENTS, DB_READ_WORKERS)
+from .gazetteer import gazetteer_key, lookup_city
+
+
+# Соединения живут весь срок потока: у каждого потока своё, с настроенными PRAGMA и кэшем подготовленных запросов
+_local = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Долгоживущее соединение текущего потока
+
+    WAL позволяет читателям не ждать писателя, synchronous=NORMAL в WAL не делает fsync на каждый коммит.
+    Используется как `with get_connection() as conn:` — блок становится транзакцией, соединение не закрывается.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.path != DB_PATH:
+        # База сменилась (тесты, бенчмарк): соединение потока открывается заново
+        close_connection()
+        conn = None
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT, cached_statements=SQLITE_CACHED_STATEMENTS)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        _local.conn, _local.path = conn, DB_PATH
+    return conn
+
+
+def close_connection():
+    """Закрытие соединения текущего потока"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+# Запись идёт в одном потоке (SQLite всё равно допускает одного писателя), чтение — в ограниченном пуле
+_reader_executor = ThreadPoolExecutor(max_workers=DB_READ_WORKERS, thread_name_prefix='db-reader')
+_writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+
+
+async def db_read(func: Callable, *args, **kwargs):
+    """Выполнение читающей функции базы в пуле читателей, не блокируя event loop"""
+    return await asyncio.get_running_loop().run_in_executor(_reader_executor, partial(func, *args, **kwargs))
+
+
+async def db_write(func: Callable, *args, **kwargs):
+    """Выполнение пишущей функции базы в потоке писателя, не блокируя event loop"""
+    return await asyncio.get_running_loop().run_in_executor(_writer_executor, partial(func, *args, **kwargs))
 
 
 def init_db():
     """Создание базы данных"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS employees (
@@ -13,9 +74,49 @@ def init_db():
             email TEXT NOT NULL,
             city TEXT NOT NULL,
             department TEXT,
-            position TEXT
+            position TEXT,
+            city_id TEXT
+        )
+    """)
+    # city_id (город после нормализации) добавлен позже: старые базы дополняем, значения заполняются при запуске
+    cursor.execute("PRAGMA table_info(employees)")
+    if 'city_id' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE employees ADD COLUMN city_id TEXT")
+    # Полнотекстовый индекс сотрудников для поиска; триггеры держат его в согласии с таблицей employees
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'employees_fts'")
+    fts_exists = cursor.fetchone() is not None
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS employees_fts USING fts5(
+            name, email, department, position, city,
+            content = '', tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
         )
     """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS employees_fts_insert AFTER INSERT ON employees BEGIN
+            INSERT INTO employees_fts (rowid, name, email, department, position, city)
+            VALUES (new.id, new.name, new.email, new.department, new.position, new.city_id);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS employees_fts_delete AFTER DELETE ON employees BEGIN
+            INSERT INTO employees_fts (employees_fts, rowid, name, email, department, position, city)
+            VALUES ('delete', old.id, old.name, old.email, old.department, old.position, old.city_id);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS employees_fts_update AFTER UPDATE ON employees BEGIN
+            INSERT INTO employees_fts (employees_fts, rowid, name, email, department, position, city)
+            VALUES ('delete', old.id, old.name, old.email, old.department, old.position, old.city_id);
+            INSERT INTO employees_fts (rowid, name, email, department, position, city)
+            VALUES (new.id, new.name, new.email, new.department, new.position, new.city_id);
+        END
+    """)
+    if not fts_exists:
+        # Индекс появился позже таблицы: сотрудников, записанных раньше, индексируем один раз
+        cursor.execute("""
+            INSERT INTO employees_fts (rowid, name, email, department, position, city)
+            SELECT id, name, email, department, position, city_id FROM employees
+        """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS visits (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -23,103 +124,612 @@ def init_db():
             visit_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rejected_users (
+            id INTEGER PRIMARY KEY,
+            reason TEXT NOT NULL,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            task_id TEXT PRIMARY KEY,
+            start_id INTEGER NOT NULL,
+            end_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            processed INTEGER DEFAULT 0,
+            added_count INTEGER DEFAULT 0,
+            skipped_count INTEGER DEFAULT 0,
+            errors TEXT DEFAULT '[]',
+            status TEXT NOT NULL,
+            message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS city_coordinates (
+            city TEXT PRIMARY KEY,
+            lat REAL,
+            lon REAL,
+            source TEXT NOT NULL,
+            is_override INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Заданные вручную координаты не перезаписывают переопределения, сделанные через админку
+    cursor.executemany("""
+        INSERT OR IGNORE INTO city_coordinates (city, lat, lon, source, is_override)
+        VALUES (?, ?, ?, 'override', 1)
+    """, [(city, lat, lon) for city, (lat, lon) in CITY_COORDINATE_OVERRIDES.items()])
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS city_aliases (
+            alias TEXT PRIMARY KEY,
+            city TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.executemany("INSERT OR IGNORE INTO city_aliases (alias, city) VALUES (?, ?)",
+                       [(gazetteer_key(alias), city) for alias, city in CITY_ALIASES.items()])
     conn.commit()
-    conn.close()
 
 
-def get_or_fetch_user_data(user_id: int):
-    """Функция для получения данных из базы или API"""
-    # Проверяем наличие пользователя в базе
-    user_data = None
+def get_existing_ids(start_id: int, end_id: int) -> set:
+    """ID сотрудников из диапазона, уже сохранённых в базе (одним запросом)"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM employees WHERE id BETWEEN ? AND ?", (start_id, end_id))
+            return {row[0] for row in cursor.fetchall()}
+    except sqlite3.Error as e:
+        logger.error(f"Database error when fetching existing ids: {e}")
+        return set()
+
+
+def parse_employee(user: dict):
+    """Строка таблицы employees из пользователя Redmine (None, если почта не корпоративная)"""
+    from .cities import normalize_city
+    email = user.get('mail') or ''
+    if not email.endswith(CORPORATE_DOMAIN):
+        return None
+    name = f"{user['firstname']} {user['lastname']}"
+    city = "No city"
+    department = None
+    position = None
+    for field in user.get('custom_fields', []):
+        if field['name'] == 'Город проживания':
+            city = (field.get('value') or "").strip() or "No city"
+        elif field['name'] == 'Отдел':
+            department = field.get('value') or None
+        elif field['name'] == 'Должность':
+            position = field.get('value') or None
+    # Город нормализуется при записи, чтобы пересборка карты не разбирала написания заново
+    return (user['id'], name, email, city, department, position, normalize_city(city))
+
+
+UPSERT_EMPLOYEE_SQL = """
+    INSERT INTO employees (id, name, email, city, department, position, city_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        name = excluded.name,
+        email = excluded.email,
+        city = excluded.city,
+        department = excluded.department,
+        position = excluded.position,
+        city_id = excluded.city_id
+"""
+
+REJECT_USER_SQL = """
+    INSERT OR REPLACE INTO rejected_users (id, reason, checked_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+"""
+
+
+def _chunks(items: list, size: int = DB_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def upsert_employees(rows: List[tuple]) -> List[tuple]:
+    """Вставка или обновление пачки сотрудников в одной транзакции; возвращает изменившиеся строки
+
+    Пустые отдел и должность из Redmine не затирают значения, загруженные из Google Sheets.
+    Ошибка базы пробрасывается: синхронизация не должна сдвигать отметку updated_on за несохранённую страницу.
+    """
+    if not rows:
+        return []
+    changed = []
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            existing = {}
+            for chunk in _chunks([row[0] for row in rows]):
+                cursor.execute(
+                    f"SELECT id, name, email, city, department, position, city_id FROM employees "
+                    f"WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                existing.update({row[0]: row for row in cursor.fetchall()})
+            for user_id, name, email, city, department, position, city_id in rows:
+                current = existing.get(user_id)
+                if current:
+                    department = department or current[4]
+                    position = position or current[5]
+                row = (user_id, name, email, city, department, position, city_id)
+                if row != current:
+                    changed.append(row)
+            cursor.executemany(UPSERT_EMPLOYEE_SQL, changed)
+            conn.commit()
+            logger.info(f"Saved {len(changed)} of {len(rows)} employees to database")
+    except sqlite3.Error as e:
+        logger.error(f"Database error when saving {len(rows)} employees: {e}")
+        raise
+    return changed
+
+
+def delete_employees(user_ids: List[int]) -> int:
+    """Удаление сотрудников (заблокированы или сменили почту); возвращает количество удалённых"""
+    if not user_ids:
+        return 0
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("DELETE FROM employees WHERE id = ?", [(user_id,) for user_id in user_ids])
+            conn.commit()
+            if cursor.rowcount:
+                logger.info(f"Removed {cursor.rowcount} employees from database")
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Database error when deleting employees: {e}")
+        raise
+
+
+def save_import_batch(rows: List[tuple], rejections: List[tuple], checkpoint: dict = None):
+    """Сохранение пачки импорта в одной транзакции
+
+    Новые сотрудники, отклонённые ID (id, reason) и контрольная точка задачи записываются вместе,
+    поэтому после рестарта продолжение не теряет и не дублирует уже обработанные ID.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(UPSERT_EMPLOYEE_SQL, rows)
+            cursor.executemany(REJECT_USER_SQL, rejections)
+            if checkpoint:
+                cursor.execute("""
+                    UPDATE import_jobs SET
+                    last_id = ?, processed = ?, added_count = ?, skipped_count = ?, errors = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                    WHERE task_id = ?
+                """, (
+                    checkpoint['last_id'],
+                    checkpoint['processed'],
+                    checkpoint['added_count'],
+                    checkpoint['skipped_count'],
+                    json.dumps(checkpoint['errors']),
+                    checkpoint['task_id']
+                ))
+            conn.commit()
+            logger.info(f"Saved {len(rows)} employees and {len(rejections)} rejected IDs to database")
+    except sqlite3.Error as e:
+        logger.error(f"Database error when saving import batch: {e}")
+        raise
+
+
+def create_import_job(task_id: str, start_id: int, end_id: int):
+    """Создание записи о задаче импорта диапазона"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT OR REPLACE INTO import_jobs (task_id, start_id, end_id, last_id, status)
+            VALUES (?, ?, ?, ?, 'running')
+        """, (task_id, start_id, end_id, start_id - 1))
+        conn.commit()
+
+
+def _import_job_from_row(row: sqlite3.Row) -> dict:
+    job = dict(row)
+    job['errors'] = json.loads(job['errors'] or '[]')
+    return job
+
+
+def get_import_job(task_id: str):
+    """Получение задачи импорта с последней контрольной точкой"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute("SELECT * FROM import_jobs WHERE task_id = ?", (task_id,))
+            row = cursor.fetchone()
+            return _import_job_from_row(row) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Database error when fetching import job {task_id}: {e}")
+        return None
+
+
+def get_import_jobs(limit: int = 20) -> List[dict]:
+    """Последние задачи импорта"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute("SELECT * FROM import_jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+            return [_import_job_from_row(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"Database error when fetching import jobs: {e}")
+        return []
+
+
+def set_import_job_status(task_id: str, status: str, message: str = None):
+    """Смена статуса задачи импорта (running, completed, failed, interrupted)"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE import_jobs SET status = ?, message = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE task_id = ?
+            """, (status, message, task_id))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error when updating import job {task_id}: {e}")
+
+
+def mark_interrupted_jobs() -> int:
+    """Перевод задач, оставшихся в статусе running после рестарта, в interrupted"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE import_jobs SET status = 'interrupted', updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'running'
+            """)
+            conn.commit()
+            if cursor.rowcount:
+                logger.warning(f"{cursor.rowcount} import jobs were interrupted by restart")
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Database error when marking interrupted jobs: {e}")
+        return 0
+
+
+def get_rejected_ids(start_id: int, end_id: int) -> set:
+    """ID из диапазона, отклонённые не раньше NEGATIVE_CACHE_TTL секунд назад"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id FROM rejected_users
+                WHERE id BETWEEN ? AND ? AND checked_at >= datetime('now', ?)
+            """, (start_id, end_id, f"-{NEGATIVE_CACHE_TTL} seconds"))
+            return {row[0] for row in cursor.fetchall()}
+    except sqlite3.Error as e:
+        logger.error(f"Database error when fetching rejected users: {e}")
+        return set()
+
+
+def get_rejected_stats() -> dict:
+    """Количество отклонённых ID по причинам"""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT name, email, city, department, position FROM employees WHERE id = ?", (user_id,))
+            cursor.execute("SELECT reason, COUNT(*) FROM rejected_users GROUP BY reason")
+            return dict(cursor.fetchall())
+    except sqlite3.Error as e:
+        logger.error(f"Database error when counting rejected users: {e}")
+        return {}
+
+
+def clear_rejected(start_id: int = None, end_id: int = None):
+    """Очистка негативного кэша (целиком или для диапазона)"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            if start_id is None:
+                cursor.execute("DELETE FROM rejected_users")
+            else:
+                cursor.execute("DELETE FROM rejected_users WHERE id BETWEEN ? AND ?", (start_id, end_id))
+            conn.commit()
+            logger.info(f"Cleared {cursor.rowcount} rejected users")
+    except sqlite3.Error as e:
+        logger.error(f"Database error when clearing rejected users: {e}")
+
+
+def get_sync_state(key: str):
+    """Получение значения состояния синхронизации"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT value FROM sync_state WHERE key = ?", (key,))
             result = cursor.fetchone()
+            return result[0] if result else None
+    except sqlite3.Error as e:
+        logger.error(f"Database error when reading sync state {key}: {e}")
+        return None
+
 
-        if result:
-            name, email, city, department, position = result
-            logger.debug(f"User {user_id} found in database: {name}, {email}, {city}, {department}, {position}")
+def set_sync_state(key: str, value: str):
+    """Сохранение значения состояния синхронизации"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error when saving sync state {key}: {e}")
+
+
+def load_city_coordinates() -> dict:
+    """Все сохранённые координаты городов: {city: {'coordinates', 'source', 'is_override', 'fresh'}}"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT city, lat, lon, source, is_override,
+                    is_override = 1 OR updated_at >= datetime('now', CASE WHEN lat IS NULL THEN ? ELSE ? END)
+                FROM city_coordinates
+            """, (f"-{GEOCODE_MISS_TTL} seconds", f"-{GEOCODE_TTL} seconds"))
             return {
-                'user': {
-                    'id': user_id,
-                    'firstname': name.split()[0],
-                    'lastname': ' '.join(name.split()[1:]),
-                    'mail': email,
-                    'custom_fields': [
-                        {'name': 'Город проживания', 'value': city},
-                        {'name': 'Отдел', 'value': department or ''},
-                        {'name': 'Должность', 'value': position or ''}
-                    ]
+                city: {
+                    'coordinates': [lat, lon] if lat is not None else None,
+                    'source': source,
+                    'is_override': bool(is_override),
+                    'fresh': bool(fresh)
                 }
+                for city, lat, lon, source, is_override, fresh in cursor.fetchall()
             }
     except sqlite3.Error as e:
-        logger.error(f"Database error when fetching user {user_id}: {e}")
-
-    # Если не нашли в базе, получаем из API
-    from .services import get_user_data, clean_city_name
-    if not user_data:
-        user_data = get_user_data(user_id)
-        if user_data:
-            user = user_data['user']
-            email = user.get('mail', '')
-            if email.endswith('@futuretoday.ru'):
-                name = f"{user['firstname']} {user['lastname']}"
-                city = "No city"
-                department = None
-                position = None
-                for field in user.get('custom_fields', []):
-                    if field['name'] == 'Город проживания':
-                        city = field.get('value') or "No city"
-                    elif field['name'] == 'Отдел':
-                        department = field.get('value') or None
-                    elif field['name'] == 'Должность':
-                        position = field.get('value') or None
-                city = clean_city_name(city) or "No city"
-
-                try:
-                    with sqlite3.connect(DB_PATH) as conn:
-                        cursor = conn.cursor()
-                        cursor.execute("""
-                            INSERT OR REPLACE INTO employees (id, name, email, city, department, position)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        """, (user_id, name, email, city, department, position))
-                        conn.commit()
-                        logger.info(f"User {user_id} saved to database: {name}, {email}, {city}, {department}, {position}")
-                except sqlite3.Error as e:
-                    logger.error(f"Database error when saving user {user_id}: {e}")
-
-    return user_data
+        logger.error(f"Database error when loading city coordinates: {e}")
+        return {}
+
+
+def save_city_coordinates(city: str, coordinates, source: str, is_override: bool = False):
+    """Сохранение координат города (coordinates=None запоминает, что город не найден)"""
+    lat, lon = coordinates if coordinates else (None, None)
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT OR REPLACE INTO city_coordinates (city, lat, lon, source, is_override, updated_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, (city, lat, lon, source, int(is_override)))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error when saving coordinates for {city}: {e}")
+
+
+def delete_city_coordinates(city: str) -> bool:
+    """Удаление координат города (после удаления переопределения город снова геокодируется)"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM city_coordinates WHERE city = ?", (city,))
+            conn.commit()
+            return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Database error when deleting coordinates for {city}: {e}")
+        return False
+
+
+def load_city_aliases() -> dict:
+    """Синонимы городов: {ключ написания: город}"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT alias, city FROM city_aliases")
+            return dict(cursor.fetchall())
+    except sqlite3.Error as e:
+        logger.error(f"Database error when loading city aliases: {e}")
+        return {}
+
+
+def save_city_alias(alias: str, city: str):
+    """Сохранение синонима города (написание приводится к ключу поиска)"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT OR REPLACE INTO city_aliases (alias, city) VALUES (?, ?)", (gazetteer_key(alias), city))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error when saving city alias {alias}: {e}")
+
+
+def delete_city_alias(alias: str) -> bool:
+    """Удаление синонима города"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM city_aliases WHERE alias = ?", (gazetteer_key(alias),))
+            conn.commit()
+            return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Database error when deleting city alias {alias}: {e}")
+        return False
+
+
+def get_employee_cities(only_missing: bool = False) -> List[tuple]:
+    """Исходные города сотрудников: [(id, city, city_id)]"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, city, city_id FROM employees" + (" WHERE city_id IS NULL" if only_missing else ""))
+            return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Database error when fetching employee cities: {e}")
+        return []
+
+
+def set_employee_city_ids(rows: List[tuple]):
+    """Запись нормализованных городов пачкой: [(city_id, id)]"""
+    if not rows:
+        return
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("UPDATE employees SET city_id = ? WHERE id = ?", rows)
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error when saving employee city ids: {e}")
+
+
+def get_employee_city_ids(user_ids: List[int]) -> dict:
+    """Текущие города сотрудников: {id: city_id}"""
+    result = {}
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            for chunk in _chunks(list(user_ids)):
+                cursor.execute(f"SELECT id, city_id FROM employees WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                result.update(cursor.fetchall())
+    except sqlite3.Error as e:
+        logger.error(f"Database error when fetching employee city ids: {e}")
+    return result
+
+
+def get_employee_assignments() -> List[tuple]:
+    """Текущие отдел и должность всех сотрудников: [(id, department, position, city_id)]"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, department, position, city_id FROM employees")
+            return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Database error when fetching employee assignments: {e}")
+        return []
+
+
+def update_employee_assignments(rows: List[tuple]):
+    """Запись отдела и должности пачкой в одной транзакции: [(department, position, id)]"""
+    if not rows:
+        return
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("UPDATE employees SET department = ?, position = ? WHERE id = ?", rows)
+            conn.commit()
+            logger.info(f"Updated department and position of {len(rows)} employees")
+    except sqlite3.Error as e:
+        logger.error(f"Database error when updating employee assignments: {e}")
+        raise
+
+
+def _employee_from_row(row) -> dict:
+    return {
+        'id': row[0],
+        'name': row[1],
+        'profile_url': f"{REDMINE_URL}/users/{row[0]}",
+        'city': row[3],
+        'city_id': row[6],
+        'department': row[4] if row[4] and row[4] != 'None' else None,
+        'position': row[5] if row[5] and row[5] != 'None' else None
+    }
+
+
+def get_employees_by_city(city_ids: List[str]) -> List[dict]:
+    """Сотрудники из указанных городов (для пересборки только изменившихся городов карты)"""
+    employees = []
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            for chunk in _chunks(list(city_ids)):
+                cursor.execute(
+                    f"SELECT id, name, email, city, department, position, city_id FROM employees "
+                    f"WHERE city_id IN ({','.join('?' * len(chunk))})", chunk)
+                employees.extend(_employee_from_row(row) for row in cursor.fetchall())
+    except sqlite3.Error as e:
+        logger.error(f"Database error when fetching employees by city: {e}")
+    return employees
 
 
 def get_all_employees():
     """Получение сотрудиков из базы данных"""
     employees = []
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT id, name, email, city, department, position FROM employees")
+            cursor.execute("SELECT id, name, email, city, department, position, city_id FROM employees")
             for row in cursor.fetchall():
-                employees.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'profile_url': f"{REDMINE_URL}/users/{row[0]}",
-                    'city': row[3],
-                    'department': row[4] if row[4] and row[4] != 'None' else None,
-                    'position': row[5] if row[5] and row[5] != 'None' else None
-                })
+                employees.append(_employee_from_row(row))
             logger.info(f"Извлечено {len(employees)} сотрудников из базы данных")
     except sqlite3.Error as e:
         logger.error(f"Database error when fetching all employees: {e}")
     return employees
 
 
+def _fts_query(text: str) -> str:
+    """Поисковая строка пользователя в запрос FTS5: каждое слово ищется как префикс"""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _search_coordinates(city_id, lat, lon, is_override):
+    """Координаты города так же, как у маркеров карты: переопределение, офлайн-справочник, сохранённый ответ геокодера
+
+    Города из справочника в city_coordinates не записываются, поэтому одного JOIN недостаточно.
+    """
+    if is_override:
+        return [lat, lon]
+    coordinates = lookup_city(city_id) if city_id else None
+    if coordinates:
+        return coordinates
+    return [lat, lon] if lat is not None else None
+
+
+def search_employees(text: str, limit: int = 10) -> List[dict]:
+    """Поиск сотрудников по имени, почте, отделу, должности и городу (префиксы слов) с координатами города
+
+    Сначала идут совпадения по имени, затем по остальным полям. Сортировка по релевантности (rank)
+    перебирает все совпадения и на коротких префиксах слишком медленная для автодополнения,
+    поэтому внутри группы сотрудники идут в порядке индекса.
+    """
+    query = _fts_query(text)
+    if not query:
+        return []
+    results = {}
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            for match in (f'name : ({query})', query):
+                cursor.execute("""
+                    SELECT e.id, e.name, e.email, e.city, e.department, e.position, e.city_id, c.lat, c.lon, c.is_override
+                    FROM employees_fts
+                    JOIN employees e ON e.id = employees_fts.rowid
+                    LEFT JOIN city_coordinates c ON c.city = e.city_id
+                    WHERE employees_fts MATCH ?
+                    LIMIT ?
+                """, (match, limit))
+                for row in cursor.fetchall():
+                    if row[0] not in results:
+                        employee = _employee_from_row(row)
+                        employee['coordinates'] = _search_coordinates(row[6], row[7], row[8], row[9])
+                        results[row[0]] = employee
+                if len(results) >= limit:
+                    break
+    except sqlite3.Error as e:
+        logger.error(f"Database error when searching employees: {e}")
+        return []
+    return list(results.values())[:limit]
+
+
+def count_employees() -> int:
+    """Количество сотрудников в базе"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM employees")
+            return cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Database error when counting employees: {e}")
+        return 0
+
+
 def get_unique_visitors(date_start, date_end):
     """Получение уникальных посетителей из базы данных"""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             # Если даты одинаковые, фильтруем по точной дате
             if date_start == date_end:
@@ -144,7 +754,7 @@ def get_unique_visitors(date_start, date_end):
 def get_total_visits(date_start, date_end):
     """Получение всех посетителей из базы данных"""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             # Если даты одинаковые, фильтруем по точной дате
             if date_start == date_end:
@@ -166,12 +776,15 @@ def get_total_visits(date_start, date_end):
         return 0
 
 
-def record_visit(visitor_id):
-    """Запись посетителей в базу данных"""
+def record_visits(visits: List[tuple]):
+    """Запись пачки посещений в одной транзакции: [(visitor_id, visit_time)]"""
+    if not visits:
+        return
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("INSERT INTO visits (visitor_id) VALUES (?)", (visitor_id,))
+            cursor.executemany("INSERT INTO visits (visitor_id, visit_time) VALUES (?, ?)", visits)
             conn.commit()
-    except sqlite3.OperationalError as e:
-        logger.error(f"Ошибка записи в базу данных: {e}")        
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка записи {len(visits)} посещений в базу данных: {e}")
+        raise
@@ -0,0 +1,73 @@
+from typing import Dict, Iterable, List, Optional
+
+# Поля сотрудников, по которым строятся фильтры карты
+FACETS = ('department', 'position')
+
+
+def city_postings(employees: List[dict]) -> Dict[str, Dict[str, int]]:
+    """Битовые маски сотрудников города по значениям фильтров: {facet: {значение: маска}}
+
+    Бит i соответствует i-му сотруднику в списке города (в том же порядке, что и /map_data/{city}).
+    """
+    postings = {facet: {} for facet in FACETS}
+    for i, employee in enumerate(employees):
+        for facet in FACETS:
+            value = employee.get(facet)
+            if value:
+                postings[facet][value] = postings[facet].get(value, 0) | (1 << i)
+    return postings
+
+
+class FacetIndex:
+    """Инвертированные индексы значений фильтров: {facet: {значение: {город: маска}}}
+
+    Фильтрация пересекает маски городов и не обращается к базе и спискам сотрудников.
+    """
+
+    def __init__(self, markers: Dict[str, dict], postings: Dict[str, dict]):
+        self.markers = markers
+        # Маска всех сотрудников города — фильтр, который ничего не отбирает
+        self.all = {city: (1 << marker['count']) - 1 for city, marker in markers.items()}
+        self.index = {facet: {} for facet in FACETS}
+        for city, city_facets in postings.items():
+            if city not in markers:
+                continue
+            for facet in FACETS:
+                for value, mask in city_facets.get(facet, {}).items():
+                    self.index[facet].setdefault(value, {})[city] = mask
+
+    def _masks(self, facet: str, values: Optional[Iterable[str]]) -> Dict[str, int]:
+        """Маски городов для значений одного фильтра (несколько значений объединяются)"""
+        if not values:
+            return self.all
+        masks = {}
+        for value in values:
+            for city, mask in self.index[facet].get(value, {}).items():
+                masks[city] = masks.get(city, 0) | mask
+        return masks
+
+    @staticmethod
+    def _intersect(masks: List[Dict[str, int]]) -> Dict[str, int]:
+        result = masks[0]
+        for other in masks[1:]:
+            result = {city: mask & other[city] for city, mask in result.items() if city in other}
+        return {city: mask for city, mask in result.items() if mask}
+
+    def filter(self, selected: Dict[str, Optional[List[str]]]) -> dict:
+        """Маркеры с числом подходящих сотрудников и количество сотрудников по каждому значению фильтров
+
+        Счётчики значения фильтра учитывают выбор в остальных фильтрах, но не в нём самом.
+        """
+        facet_masks = {facet: self._masks(facet, selected.get(facet)) for facet in FACETS}
+        matched = self._intersect(list(facet_masks.values()))
+        markers = [dict(self.markers[city], count=mask.bit_count()) for city, mask in matched.items()]
+
+        counts = {}
+        for facet in FACETS:
+            others = self._intersect([self.all] + [masks for name, masks in facet_masks.items() if name != facet])
+            counts[facet] = {}
+            for value, cities in self.index[facet].items():
+                count = sum((mask & others[city]).bit_count() for city, mask in cities.items() if city in others)
+                if count:
+                    counts[facet][value] = count
+        return {'markers': markers, 'facets': counts}
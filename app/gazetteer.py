@@ -0,0 +1,61 @@
+import re
+import threading
+import unicodedata
+
+from typing import Dict, List, Optional, Tuple
+
+from .config import GAZETTEER_PATH, logger
+
+# Индекс справочника: нормализованное название (русское или латинское) -> (основное название, координаты)
+_index: Optional[Dict[str, Tuple[str, List[float]]]] = None
+_index_lock = threading.Lock()
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def gazetteer_key(name: str) -> str:
+    """Ключ поиска: Unicode-форма, регистр, «ё», дефисы, знаки препинания и лишние пробелы не учитываются"""
+    name = unicodedata.normalize('NFKC', name).casefold().replace('ё', 'е')
+    name = _PUNCTUATION_RE.sub(' ', name)
+    return _SPACES_RE.sub(' ', name).strip()
+
+
+def _load_index() -> Dict[str, Tuple[str, List[float]]]:
+    """Чтение справочника из TSV: name, country, lat, lon, alt_names (через |)"""
+    index = {}
+    try:
+        with open(GAZETTEER_PATH, encoding='utf-8') as file:
+            for line in file:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                name, _country, lat, lon, alt_names = line.rstrip('\n').split('\t')
+                coordinates = [float(lat), float(lon)]
+                for alias in [name, *alt_names.split('|')]:
+                    if alias:
+                        # При совпадении названий остаётся город, который стоит в файле раньше (крупнее)
+                        index.setdefault(gazetteer_key(alias), (name, coordinates))
+    except (OSError, ValueError) as e:
+        logger.error(f"Error loading gazetteer {GAZETTEER_PATH}: {e}")
+    logger.info(f"Загружено {len(index)} названий городов из справочника")
+    return index
+
+
+def _get_index() -> Dict[str, Tuple[str, List[float]]]:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _load_index()
+    return _index
+
+
+def lookup_city(city: str) -> Optional[List[float]]:
+    """Координаты города из офлайн-справочника (None, если города нет)"""
+    entry = _get_index().get(gazetteer_key(city))
+    return entry[1] if entry else None
+
+
+def gazetteer_names() -> Dict[str, str]:
+    """Все названия справочника: ключ поиска -> основное название города"""
+    return {key: name for key, (name, _) in _get_index().items()}
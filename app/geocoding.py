@@ -0,0 +1,135 @@
+import asyncio
+import httpx
+
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from .config import NOMINATIM_ENABLED, GEOCODE_RETRY_ATTEMPTS, GEOCODE_RETRY_DELAY, logger
+from .database import save_city_coordinates, db_write
+from .gazetteer import lookup_city
+from .ratelimit import (NOMINATIM_HOST, THROTTLE_STATUSES, ThrottledError, backoff_delay, call_with_retry_async,
+                        parse_retry_after)
+
+# Запросы, которые уже выполняются: повторный запрос того же города ждёт первый
+_inflight: Dict[str, asyncio.Task] = {}
+
+# Фоновые повторы неудачных запросов (город -> задача)
+_retries: Dict[str, asyncio.Task] = {}
+
+
+def create_geocoder_client() -> httpx.AsyncClient:
+    """Клиент Nominatim с keep-alive соединением (политика Nominatim — один запрос за раз)"""
+    return httpx.AsyncClient(
+        base_url=f"https://{NOMINATIM_HOST}",
+        headers={'User-Agent': 'FT_map/1.0 (imatveev@futuretoday.ru)'},
+        limits=httpx.Limits(max_connections=1, max_keepalive_connections=1),
+        timeout=10
+    )
+
+
+async def _search(client: httpx.AsyncClient, city: str) -> Optional[List[float]]:
+    """Один запрос к Nominatim; 429/503 превращаются в ThrottledError"""
+    response = await client.get("/search", params={'q': city, 'format': 'json', 'limit': 1})
+    if response.status_code in THROTTLE_STATUSES:
+        raise ThrottledError(response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+    response.raise_for_status()
+    results = response.json()
+    return [float(results[0]['lat']), float(results[0]['lon'])] if results else None
+
+
+async def _geocode(client: httpx.AsyncClient, city: str) -> Optional[List[float]]:
+    """Запрос через лимитер Nominatim с сохранением ответа (в том числе «не найден») в базу"""
+    coordinates = await call_with_retry_async(NOMINATIM_HOST, _search, client, city)
+    await db_write(save_city_coordinates, city, coordinates, 'nominatim' if coordinates else 'not_found')
+    if coordinates:
+        logger.info(f"Координаты для города {city}: {coordinates}")
+    else:
+        logger.warning(f"Город {city} не найден в геокодере")
+    return coordinates
+
+
+async def geocode_city(client: httpx.AsyncClient, city: str) -> Optional[List[float]]:
+    """Координаты города из Nominatim; одновременные запросы одного города объединяются в один"""
+    task = _inflight.get(city)
+    if task is None:
+        task = asyncio.create_task(_geocode(client, city))
+        _inflight[city] = task
+        task.add_done_callback(lambda _: _inflight.pop(city, None))
+    return await asyncio.shield(task)
+
+
+def known_coordinates(city: str, cache: dict) -> Optional[List[float]]:
+    """Координаты без обращения к сети: переопределения, офлайн-справочник, сохранённый ответ геокодера"""
+    entry = cache.get(city)
+    if entry and entry['is_override']:
+        return entry['coordinates']
+    coordinates = lookup_city(city)
+    if coordinates:
+        return coordinates
+    return entry['coordinates'] if entry else None
+
+
+def needs_geocoding(city: str, cache: dict) -> bool:
+    """Город не найден офлайн, а сохранённого ответа геокодера нет или он устарел"""
+    entry = cache.get(city)
+    if entry and (entry['is_override'] or entry['fresh']):
+        return False
+    return NOMINATIM_ENABLED and not lookup_city(city)
+
+
+async def resolve_coordinates(cities: Iterable[str], cache: dict,
+                              on_retry_success: Optional[Callable[[str], Awaitable]] = None) -> Dict[str, Optional[List[float]]]:
+    """Координаты всех городов карты
+
+    В сеть уходят только города, которых нет офлайн; запросы идут параллельно в темпе лимитера Nominatim.
+    Города, которые не удалось запросить, повторяются в фоне; после удачного повтора вызывается on_retry_success(city).
+    """
+    cities = [city for city in cities if city and city != "No city"]
+    to_geocode = [city for city in cities if needs_geocoding(city, cache)]
+    result = {city: known_coordinates(city, cache) for city in cities}
+    if not to_geocode:
+        return result
+
+    logger.info(f"Геокодирование {len(to_geocode)} новых городов")
+    async with create_geocoder_client() as client:
+        answers = await asyncio.gather(*(geocode_city(client, city) for city in to_geocode), return_exceptions=True)
+    failed = []
+    for city, answer in zip(to_geocode, answers):
+        if isinstance(answer, Exception):
+            # Остаётся устаревший ответ из базы (если он был), а город уходит на повтор
+            logger.warning(f"Геокодер недоступен для города {city}: {answer}")
+            failed.append(city)
+        else:
+            result[city] = answer
+    if failed:
+        schedule_retry(failed, on_retry_success)
+    return result
+
+
+def schedule_retry(cities: List[str], on_success: Optional[Callable[[str], Awaitable]] = None):
+    """Фоновый повтор запросов с экспоненциальной задержкой"""
+    for city in cities:
+        if city not in _retries:
+            task = asyncio.create_task(_retry_city(city, on_success))
+            _retries[city] = task
+            task.add_done_callback(lambda _, city=city: _retries.pop(city, None))
+
+
+async def _retry_city(city: str, on_success: Optional[Callable[[str], Awaitable]]):
+    """Повторяет запрос города, пока он не пройдёт или не кончатся попытки"""
+    for attempt in range(GEOCODE_RETRY_ATTEMPTS):
+        await asyncio.sleep(GEOCODE_RETRY_DELAY + backoff_delay(attempt, base=GEOCODE_RETRY_DELAY, cap=3600))
+        try:
+            async with create_geocoder_client() as client:
+                coordinates = await geocode_city(client, city)
+        except (ThrottledError, httpx.HTTPError) as e:
+            logger.warning(f"Повтор {attempt + 1}/{GEOCODE_RETRY_ATTEMPTS} для города {city} не удался: {e}")
+            continue
+        if coordinates and on_success:
+            await on_success(city)
+        return
+    logger.error(f"Город {city} не удалось геокодировать за {GEOCODE_RETRY_ATTEMPTS} попыток")
+
+
+def pending_retries() -> List[str]:
+    """Города, ожидающие фонового повтора"""
+    return sorted(_retries)
@@ -0,0 +1,220 @@
+import asyncio
+import inspect
+import json
+import time
+import redis
+import redis.asyncio
+
+from .config import (JOB_BACKEND, JOB_TTL, JOB_LEASE_TTL, JOB_MAX_ATTEMPTS, WORKER_ID, WORKER_CONCURRENCY,
+                     REDIS_HOST, REDIS_PORT, logger)
+from .database import set_import_job_status, db_write
+from .services import process_users, sync_users, process_sheet_update
+
+# Очередь идентификаторов задач: API кладёт слева, воркеры забирают справа
+JOB_QUEUE_KEY = "jobs:queue"
+
+# Задачи, которые воркер забрал, но ещё не закончил: список jobs:processing:{worker_id}
+JOB_PROCESSING_KEY = "jobs:processing"
+
+# Аренда воркера: ключ jobs:lease:{worker_id} живёт JOB_LEASE_TTL секунд и продлевается, пока воркер работает
+JOB_LEASE_KEY = "jobs:lease"
+
+# Воркеры, у которых могут остаться незаконченные задачи
+JOB_WORKERS_KEY = "jobs:workers"
+
+# Задача переходит из списка выполняемых в очередь, только если её ещё никто не забрал
+REQUEUE_SCRIPT = """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Задачи, которые можно поставить в очередь
+JOB_HANDLERS = {
+    'process_users': process_users,
+    'sync_users': sync_users,
+    'process_sheet_update': process_sheet_update,
+}
+
+# Инициализация Redis-клиента
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+
+# Задачи локального бэкенда (статусы и ссылки на asyncio-задачи, чтобы их не собрал GC)
+local_jobs = {}
+local_tasks = set()
+
+
+def job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def processing_key(worker_id: str) -> str:
+    return f"{JOB_PROCESSING_KEY}:{worker_id}"
+
+
+def lease_key(worker_id: str) -> str:
+    return f"{JOB_LEASE_KEY}:{worker_id}"
+
+
+def _save_job(job: dict):
+    if JOB_BACKEND == 'local':
+        local_jobs[job['id']] = job
+        return
+    redis_client.hset(job_key(job['id']), mapping={k: json.dumps(v) for k, v in job.items()})
+    if job['status'] in ('completed', 'failed'):
+        redis_client.expire(job_key(job['id']), JOB_TTL)
+
+
+def get_job(job_id: str):
+    """Статус задачи (queued, running, completed, failed)"""
+    if JOB_BACKEND == 'local':
+        return local_jobs.get(job_id)
+    data = redis_client.hgetall(job_key(job_id))
+    return {k: json.loads(v) for k, v in data.items()} if data else None
+
+
+def enqueue_job(name: str, job_id: str, **kwargs) -> dict:
+    """Постановка задачи в очередь; API-процесс только ставит задачи и читает их статус"""
+    if name not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job {name}")
+    job = {'id': job_id, 'name': name, 'kwargs': kwargs, 'status': 'queued', 'error': None, 'attempts': 0,
+           'created_at': time.time(), 'started_at': None, 'finished_at': None}
+    _save_job(job)
+    if JOB_BACKEND == 'local':
+        # Запуск в текущем event loop (тесты и разработка без воркера)
+        task = asyncio.get_running_loop().create_task(run_job(job_id))
+        local_tasks.add(task)
+        task.add_done_callback(local_tasks.discard)
+    else:
+        redis_client.lpush(JOB_QUEUE_KEY, job_id)
+    logger.info(f"Job {job_id} ({name}) queued via {JOB_BACKEND} backend")
+    return job
+
+
+async def run_job(job_id: str):
+    """Выполнение задачи по её записи"""
+    job = get_job(job_id)
+    if not job:
+        logger.error(f"Job {job_id} not found")
+        return
+    handler = JOB_HANDLERS[job['name']]
+    kwargs = dict(job['kwargs'])
+    job.update(status='running', started_at=time.time(), attempts=job.get('attempts', 0) + 1)
+    _save_job(job)
+    logger.info(f"Job {job_id} ({job['name']}) started")
+    try:
+        if inspect.iscoroutinefunction(handler):
+            await handler(**kwargs)
+        else:
+            await asyncio.to_thread(handler, **kwargs)
+        job['status'] = 'completed'
+    except Exception as e:
+        job.update(status='failed', error=str(e))
+        logger.error(f"Job {job_id} failed: {e}")
+    job['finished_at'] = time.time()
+    _save_job(job)
+    logger.info(f"Job {job_id} {job['status']} in {job['finished_at'] - job['started_at']:.1f}s")
+
+
+async def recover_job(client: redis.asyncio.Redis, worker_id: str, job_id: str) -> bool:
+    """Возврат задачи из списка выполняемых воркера worker_id в очередь (воркер остановился, не закончив её)
+
+    Импорт в базе отмечается прерванным и при следующем запуске продолжается с контрольной точки.
+    После JOB_MAX_ATTEMPTS запусков задача в очередь не возвращается и получает статус failed.
+    """
+    job = get_job(job_id)
+    if not job:
+        await client.lrem(processing_key(worker_id), 1, job_id)
+        return False
+    if job['name'] == 'process_users':
+        await db_write(set_import_job_status, job_id, 'interrupted', f"Воркер {worker_id} остановился")
+        job['kwargs']['resume'] = True
+    if job.get('attempts', 0) >= JOB_MAX_ATTEMPTS:
+        if await client.lrem(processing_key(worker_id), 1, job_id):
+            job.update(status='failed', error=f"Воркер остановился во время выполнения ({job['attempts']} попыток)",
+                       finished_at=time.time())
+            _save_job(job)
+            logger.error(f"Job {job_id} abandoned after {job['attempts']} attempts")
+        return False
+    # Статус меняется до возврата в очередь, чтобы не затереть его у воркера, который сразу заберёт задачу
+    job['status'] = 'queued'
+    _save_job(job)
+    requeued = await client.register_script(REQUEUE_SCRIPT)(keys=[processing_key(worker_id), JOB_QUEUE_KEY],
+                                                            args=[job_id])
+    if requeued:
+        logger.warning(f"Job {job_id} of worker {worker_id} requeued")
+    return bool(requeued)
+
+
+async def recover_worker_jobs(client: redis.asyncio.Redis, worker_id: str) -> int:
+    """Возврат в очередь всех незаконченных задач воркера; возвращает их количество"""
+    recovered = 0
+    for job_id in await client.lrange(processing_key(worker_id), 0, -1):
+        recovered += await recover_job(client, worker_id, job_id)
+    return recovered
+
+
+async def _keep_lease(client: redis.asyncio.Redis, worker_id: str):
+    """Продление аренды воркера, пока он работает"""
+    while True:
+        try:
+            await client.sadd(JOB_WORKERS_KEY, worker_id)
+            await client.set(lease_key(worker_id), time.time(), ex=JOB_LEASE_TTL)
+        except redis.RedisError as e:
+            logger.error(f"Worker {worker_id}: failed to renew lease: {e}")
+        await asyncio.sleep(JOB_LEASE_TTL / 3)
+
+
+async def _recover_stale_workers(client: redis.asyncio.Redis, worker_id: str):
+    """Возврат в очередь задач воркеров с истёкшей арендой (упали, пересозданы с другим WORKER_ID, узел пропал)"""
+    while True:
+        await asyncio.sleep(JOB_LEASE_TTL)
+        try:
+            for other in await client.smembers(JOB_WORKERS_KEY):
+                if other == worker_id or await client.exists(lease_key(other)):
+                    continue
+                recovered = await recover_worker_jobs(client, other)
+                if recovered:
+                    logger.warning(f"Worker {worker_id}: requeued {recovered} jobs of stale worker {other}")
+                if not await client.llen(processing_key(other)):
+                    await client.srem(JOB_WORKERS_KEY, other)
+        except Exception as e:
+            logger.error(f"Worker {worker_id}: failed to recover stale jobs: {e}")
+
+
+async def run_worker(worker_id: str = WORKER_ID, concurrency: int = WORKER_CONCURRENCY):
+    """Цикл воркера: забирает задачи из Redis-очереди и выполняет до concurrency штук одновременно"""
+    client = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+    own_processing_key = processing_key(worker_id)
+
+    # Аренда берётся до первой задачи; другие воркеры вернут задачи этого, если он перестанет её продлевать
+    lease = asyncio.create_task(_keep_lease(client, worker_id))
+    recovery = asyncio.create_task(_recover_stale_workers(client, worker_id))
+
+    # Задачи, которые этот воркер не успел закончить до рестарта, выполняются первыми
+    recovered = await recover_worker_jobs(client, worker_id)
+    if recovered:
+        logger.warning(f"Worker {worker_id}: requeued {recovered} unfinished jobs")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    running = {lease, recovery}
+
+    async def execute(job_id: str):
+        try:
+            await run_job(job_id)
+        finally:
+            await client.lrem(own_processing_key, 1, job_id)
+            semaphore.release()
+
+    logger.info(f"Worker {worker_id} started, concurrency {concurrency}")
+    while True:
+        await semaphore.acquire()
+        job_id = await client.blmove(JOB_QUEUE_KEY, own_processing_key, 5, 'RIGHT', 'LEFT')
+        if job_id is None:
+            semaphore.release()
+            continue
+        task = asyncio.create_task(execute(job_id))
+        running.add(task)
+        task.add_done_callback(running.discard)
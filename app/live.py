@@ -0,0 +1,70 @@
+import asyncio
+import redis.asyncio
+
+from typing import Optional, Set
+
+from fastapi import WebSocket
+
+from .config import REDIS_HOST, REDIS_PORT, logger
+from .services import MAP_CHANGES_CHANNEL
+
+# Сколько секунд ждать медленный сокет, прежде чем отключить его
+SEND_TIMEOUT = 5
+
+
+class MapBroadcaster:
+    """Рассылка изменений карты всем подключённым к /ws/map клиентам процесса
+
+    Один подписчик Redis pub/sub на процесс; сообщение из канала уже сериализовано
+    и отправляется всем сокетам как есть.
+    """
+
+    def __init__(self):
+        self.sockets: Set[WebSocket] = set()
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    async def connect(self, websocket: WebSocket):
+        """Регистрация сокета; возвращается, когда подписка активна, чтобы снимок не разошёлся с изменениями"""
+        self.sockets.add(websocket)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Подписка на изменения карты ещё не активна")
+
+    def disconnect(self, websocket: WebSocket):
+        self.sockets.discard(websocket)
+
+    async def _send(self, websocket: WebSocket, message: str):
+        try:
+            await asyncio.wait_for(websocket.send_text(message), SEND_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Отключён клиент карты, не принявший изменения: {e}")
+            self.disconnect(websocket)
+
+    async def broadcast(self, message: str):
+        await asyncio.gather(*(self._send(websocket, message) for websocket in list(self.sockets)))
+
+    async def _listen(self):
+        """Чтение канала изменений; после обрыва соединения с Redis подписка восстанавливается"""
+        while self.sockets:
+            client = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(MAP_CHANGES_CHANNEL)
+                    self._subscribed.set()
+                    while self.sockets:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message:
+                            await self.broadcast(message['data'])
+            except Exception as e:
+                logger.error(f"Ошибка подписки на изменения карты: {e}")
+                await asyncio.sleep(1)
+            finally:
+                self._subscribed.clear()
+                await client.aclose()
+
+
+broadcaster = MapBroadcaster()
@@ -1,9 +1,14 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 import os
 
-from .database import init_db
+from .config import JOB_BACKEND
+from .database import init_db, mark_interrupted_jobs
 from .services import update_map_data_cache
+from .cities import load_city_index, renormalize_employees
+from .visits import visit_recorder
 from .routes.auth import router as auth_router
 from .routes.admin import router as admin_router
 from .routes.map import router as map_router
@@ -12,6 +17,9 @@ from .routes.home import router as home_router
 
 app = FastAPI()
 
+# Фоновые задачи процесса API (ссылки держим, чтобы их не собрал GC)
+background_tasks = set()
+
 # Mount static files
 app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
 
@@ -25,5 +33,19 @@ app.include_router(home_router)
 @app.on_event("startup")
 async def startup_event():
     init_db()   # Инициализация базы данных
-    update_map_data_cache()         # Инициализация кэша при старте
+    load_city_index()           # Справочник и синонимы городов для нормализации
+    renormalize_employees(only_missing=True)    # Города сотрудников, записанных до появления city_id
+    if JOB_BACKEND == 'local':
+        # Задачи выполнялись в этом процессе; при бэкенде redis их возвращает в очередь и отмечает прерванными воркер
+        mark_interrupted_jobs()     # Импорты, прерванные рестартом, можно продолжить через /resume_import
+    # Инициализация кэша при старте; геокодирование новых городов не задерживает запуск
+    task = asyncio.create_task(update_map_data_cache())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    visit_recorder.start()      # Фоновая запись посещений пачками
     # asyncio.create_task(periodic_cache_update())       # Запуск периодического обновления
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await visit_recorder.stop()     # Посещения из буфера записываются до остановки
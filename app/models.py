@@ -16,7 +16,25 @@ class UserRange(BaseModel):
     start_id: int
     end_id: int
     task_id: str
+    force: bool = False
 
 
 class SheetTask(BaseModel):
     task_id: str
+    force: bool = False
+
+
+class SyncTask(BaseModel):
+    task_id: str
+    incremental: bool = False
+
+
+class CityCoordinates(BaseModel):
+    city: str
+    lat: float
+    lon: float
+
+
+class CityAlias(BaseModel):
+    alias: str
+    city: str
@@ -0,0 +1,126 @@
+import json
+import time
+import redis
+import redis.asyncio
+
+from typing import AsyncIterator
+
+from .config import REDIS_HOST, REDIS_PORT, JOB_TTL, PROGRESS_INTERVAL
+
+# Инициализация Redis-клиента
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+
+# Через сколько секунд без событий отправлять в поток комментарий, чтобы прокси не закрыл соединение
+KEEPALIVE_INTERVAL = 15
+
+
+def progress_key(task_id: str) -> str:
+    return f"progress:{task_id}"
+
+
+def progress_channel(task_id: str) -> str:
+    return f"progress:events:{task_id}"
+
+
+def _decode(data: dict) -> dict:
+    return {key: json.loads(value) for key, value in data.items()}
+
+
+class ProgressPublisher:
+    """Прогресс задачи: поля в Redis-хэше, счётчики увеличиваются атомарно (HINCRBY)
+
+    Изменения копятся в памяти и отправляются в Redis вместе с событием в канал задачи
+    не чаще раза в PROGRESS_INTERVAL секунд; flush() отправляет их сразу.
+    """
+
+    def __init__(self, task_id: str, interval: float = PROGRESS_INTERVAL):
+        self.task_id = task_id
+        self.interval = interval
+        self.state = {}
+        self._fields = {}
+        self._increments = {}
+        self._flushed_at = 0.0
+
+    def __getitem__(self, field: str):
+        return self.state[field]
+
+    def set(self, **fields):
+        """Запись значений полей"""
+        for field, value in fields.items():
+            self.state[field] = value
+            self._fields[field] = value
+            self._increments.pop(field, None)
+        self._maybe_flush()
+
+    def incr(self, field: str, amount: int = 1):
+        """Увеличение счётчика"""
+        self.state[field] = self.state.get(field, 0) + amount
+        self._increments[field] = self._increments.get(field, 0) + amount
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Запись накопленных изменений и публикация текущего прогресса"""
+        if not self._fields and not self._increments:
+            return
+        key = progress_key(self.task_id)
+        pipe = redis_client.pipeline()
+        if self._fields:
+            pipe.hset(key, mapping={field: json.dumps(value) for field, value in self._fields.items()})
+        for field, amount in self._increments.items():
+            pipe.hincrby(key, field, amount)
+        pipe.expire(key, JOB_TTL)
+        pipe.hgetall(key)
+        progress = pipe.execute()[-1]
+        redis_client.publish(progress_channel(self.task_id), json.dumps(_decode(progress)))
+        self._fields, self._increments = {}, {}
+        self._flushed_at = time.monotonic()
+
+
+def save_progress(task_id: str, progress: dict):
+    """Сохранение прогресса задачи целиком (виден из любого процесса, истекает через JOB_TTL)"""
+    publisher = ProgressPublisher(task_id)
+    publisher.set(**progress)
+    publisher.flush()
+
+
+def load_progress(task_id: str):
+    """Получение прогресса задачи"""
+    data = redis_client.hgetall(progress_key(task_id))
+    return _decode(data) if data else None
+
+
+def is_finished(progress: dict) -> bool:
+    return progress.get('status') == 'completed' or bool(progress.get('error'))
+
+
+async def progress_events(task_id: str) -> AsyncIterator[str]:
+    """Поток Server-Sent Events с прогрессом задачи до её завершения"""
+    client = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+    try:
+        async with client.pubsub() as pubsub:
+            # Подписываемся до чтения текущего состояния, чтобы не пропустить события между ними
+            await pubsub.subscribe(progress_channel(task_id))
+            data = await client.hgetall(progress_key(task_id))
+            if data:
+                progress = _decode(data)
+                yield f"data: {json.dumps(progress)}\n\n"
+                if is_finished(progress):
+                    return
+            idle_since = time.monotonic()
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message:
+                    # Событие уже сериализовано публикующим процессом
+                    yield f"data: {message['data']}\n\n"
+                    if is_finished(json.loads(message['data'])):
+                        return
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since >= KEEPALIVE_INTERVAL:
+                    yield ": keepalive\n\n"
+                    idle_since = time.monotonic()
+    finally:
+        await client.aclose()
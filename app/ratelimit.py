@@ -0,0 +1,241 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import redis
+
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+from .config import (REDMINE_URL, REDMINE_RATE_LIMIT, NOMINATIM_RATE_LIMIT, SHEETS_RATE_LIMIT,
+                     HTTP_MAX_RETRIES, REDIS_HOST, REDIS_PORT, logger)
+
+NOMINATIM_HOST = "nominatim.openstreetmap.org"
+
+SHEETS_HOST = "sheets.googleapis.com"
+
+# Статусы, при которых сервис просит притормозить
+THROTTLE_STATUSES = (429, 503)
+
+# Бюджеты запросов в секунду по хостам
+HOST_RATE_LIMITS = {
+    urlparse(REDMINE_URL).hostname: REDMINE_RATE_LIMIT,
+    NOMINATIM_HOST: NOMINATIM_RATE_LIMIT,
+    SHEETS_HOST: SHEETS_RATE_LIMIT,
+}
+
+# Состояние лимитеров общее для API и всех воркеров: хэш ratelimit:{host} (rate, tokens, updated_at,
+# blocked_until, throttled_count) меняется Lua-скриптами атомарно и по часам Redis
+RATE_LIMIT_KEY = "ratelimit"
+
+# Последние события троттлинга по всем хостам (JSON, новые слева)
+THROTTLE_EVENTS_KEY = "ratelimit:events"
+
+# Забирает токен и возвращает, сколько секунд нужно подождать. ARGV: max_rate, burst
+RESERVE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'rate', 'tokens', 'updated_at', 'blocked_until')
+local rate = tonumber(state[1]) or tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local tokens = tonumber(state[2]) or burst
+local updated_at = tonumber(state[3]) or now
+local blocked_until = tonumber(state[4]) or 0
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate) - 1
+redis.call('HSET', KEYS[1], 'rate', rate, 'tokens', tokens, 'updated_at', now)
+local wait = 0
+if tokens < 0 then
+    wait = -tokens / rate
+end
+return tostring(math.max(wait, blocked_until - now))
+"""
+
+# Плавное увеличение скорости после успешного ответа. ARGV: max_rate
+SUCCESS_SCRIPT = """
+local max_rate = tonumber(ARGV[1])
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or max_rate
+if rate < max_rate then
+    redis.call('HSET', KEYS[1], 'rate', math.min(max_rate, rate + max_rate * 0.05))
+end
+"""
+
+# Снижение скорости вдвое и блокировка хоста на Retry-After; возвращает новую скорость.
+# ARGV: max_rate, min_rate, retry_after (0 — без блокировки)
+THROTTLE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'rate', 'tokens', 'blocked_until')
+local rate = math.max(tonumber(ARGV[2]), (tonumber(state[1]) or tonumber(ARGV[1])) / 2)
+local tokens = math.min(tonumber(state[2]) or 0, 0)
+local blocked_until = tonumber(state[3]) or 0
+local retry_after = tonumber(ARGV[3])
+if retry_after > 0 then
+    blocked_until = math.max(blocked_until, now + retry_after)
+end
+redis.call('HSET', KEYS[1], 'rate', rate, 'tokens', tokens, 'blocked_until', blocked_until)
+redis.call('HINCRBY', KEYS[1], 'throttled_count', 1)
+return tostring(rate)
+"""
+
+# Инициализация Redis-клиента
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+
+
+class ThrottledError(Exception):
+    """Внешний сервис ответил 429/503"""
+
+    def __init__(self, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status_code}, Retry-After: {retry_after}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Адаптивный token bucket для одного хоста, общий для всех процессов через Redis
+
+    Скорость растёт на 5% от максимума после каждого успешного ответа
+    и падает вдвое при 429/503. Retry-After блокирует хост целиком.
+    """
+
+    def __init__(self, host: str, max_rate: float, burst: Optional[float] = None, min_rate: Optional[float] = None):
+        self.host = host
+        self.key = f"{RATE_LIMIT_KEY}:{host}"
+        self.max_rate = max_rate
+        self.min_rate = min_rate or max_rate / 20
+        self.burst = burst or max(1.0, max_rate)
+
+    def _reserve(self) -> float:
+        """Забирает токен и возвращает, сколько секунд нужно подождать"""
+        return float(redis_client.register_script(RESERVE_SCRIPT)(keys=[self.key], args=[self.max_rate, self.burst]))
+
+    def acquire(self):
+        """Ожидание токена в синхронном коде"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Ожидание токена в асинхронном коде"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        """Плавное увеличение скорости после успешного ответа"""
+        redis_client.register_script(SUCCESS_SCRIPT)(keys=[self.key], args=[self.max_rate])
+
+    def on_throttle(self, status_code: int, retry_after: Optional[float] = None):
+        """Снижение скорости и блокировка хоста на Retry-After"""
+        rate = float(redis_client.register_script(THROTTLE_SCRIPT)(
+            keys=[self.key], args=[self.max_rate, self.min_rate, retry_after or 0]))
+        pipe = redis_client.pipeline()
+        pipe.lpush(THROTTLE_EVENTS_KEY, json.dumps({
+            'time': time.time(),
+            'host': self.host,
+            'status': status_code,
+            'retry_after': retry_after,
+            'rate': round(rate, 3),
+        }))
+        pipe.ltrim(THROTTLE_EVENTS_KEY, 0, 99)
+        pipe.execute()
+        logger.warning(f"Throttled by {self.host}: HTTP {status_code}, Retry-After {retry_after}, rate {rate:.2f}/s")
+
+    def stats(self) -> dict:
+        """Текущее состояние лимитера (общее для всех процессов)"""
+        pipe = redis_client.pipeline()
+        pipe.hgetall(self.key)
+        pipe.time()
+        state, (seconds, microseconds) = pipe.execute()
+        now = seconds + microseconds / 1e6
+        return {
+            'rate': round(float(state.get('rate', self.max_rate)), 3),
+            'max_rate': self.max_rate,
+            'min_rate': self.min_rate,
+            'tokens': round(float(state.get('tokens', self.burst)), 3),
+            'throttled_count': int(state.get('throttled_count', 0)),
+            'blocked_for': round(max(0.0, float(state.get('blocked_until', 0)) - now), 3),
+        }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host: str) -> RateLimiter:
+    """Лимитер для хоста (создаётся при первом обращении)"""
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = RateLimiter(host, HOST_RATE_LIMITS.get(host, REDMINE_RATE_LIMIT))
+        return _limiters[host]
+
+
+def configure_limiter(host: str, max_rate: float, burst: Optional[float] = None) -> RateLimiter:
+    """Явная настройка бюджета для хоста"""
+    with _limiters_lock:
+        _limiters[host] = RateLimiter(host, max_rate, burst)
+        return _limiters[host]
+
+
+def limiter_stats() -> dict:
+    """Скорости по хостам и последние события троттлинга (по всем процессам)"""
+    hosts = set(HOST_RATE_LIMITS) | {key.split(':', 1)[1] for key in redis_client.scan_iter(f"{RATE_LIMIT_KEY}:*")
+                                     if key != THROTTLE_EVENTS_KEY}
+    return {
+        'hosts': {host: get_limiter(host).stats() for host in sorted(hosts)},
+        'events': [json.loads(event) for event in reversed(redis_client.lrange(THROTTLE_EVENTS_KEY, 0, -1))],
+    }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбор заголовка Retry-After (секунды или HTTP-дата)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Экспоненциальная задержка с полным джиттером"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_retry(host: str, func, *args, **kwargs):
+    """Синхронный вызов через лимитер хоста с повтором при ThrottledError"""
+    limiter = get_limiter(host)
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        limiter.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except ThrottledError as e:
+            limiter.on_throttle(e.status_code, e.retry_after)
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        limiter.on_success()
+        return result
+
+
+async def call_with_retry_async(host: str, func, *args, **kwargs):
+    """Асинхронный вызов через лимитер хоста с повтором при ThrottledError"""
+    limiter = get_limiter(host)
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        await limiter.acquire_async()
+        try:
+            result = await func(*args, **kwargs)
+        except ThrottledError as e:
+            limiter.on_throttle(e.status_code, e.retry_after)
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+        limiter.on_success()
+        return result
@@ -0,0 +1,98 @@
+import asyncio
+import httpx
+
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from .config import REDMINE_URL, API_KEY, REDMINE_CONCURRENCY, REDMINE_TIMEOUT, REDMINE_PAGE_SIZE, logger
+from .ratelimit import THROTTLE_STATUSES, ThrottledError, call_with_retry_async, parse_retry_after
+
+
+def create_client(base_url: str = REDMINE_URL, concurrency: int = REDMINE_CONCURRENCY) -> httpx.AsyncClient:
+    """Создание клиента Redmine с пулом keep-alive соединений"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers={'X-Redmine-API-Key': API_KEY},
+        limits=limits,
+        timeout=REDMINE_TIMEOUT
+    )
+
+
+async def _get(client: httpx.AsyncClient, url: str, params: dict = None) -> httpx.Response:
+    """GET без учёта лимитов; 429/503 превращаются в ThrottledError"""
+    response = await client.get(url, params=params)
+    if response.status_code in THROTTLE_STATUSES:
+        raise ThrottledError(response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+    return response
+
+
+async def request(client: httpx.AsyncClient, url: str, params: dict = None) -> httpx.Response:
+    """GET к Redmine через лимитер хоста с повтором при 429/503"""
+    return await call_with_retry_async(client.base_url.host, _get, client, url, params)
+
+
+async def fetch_user(client: httpx.AsyncClient, user_id: int) -> Tuple[Optional[int], Optional[dict]]:
+    """Получение пользователя из Redmine вместе с HTTP-статусом (None, если ответа нет)"""
+    try:
+        response = await request(client, f"/users/{user_id}.json")
+        response.raise_for_status()
+        return response.status_code, response.json()
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Error fetching data for user {user_id}: {e}")
+        return e.response.status_code, None
+    except ThrottledError as e:
+        logger.error(f"Error fetching data for user {user_id}: {e}")
+        return e.status_code, None
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching data for user {user_id}: {e}")
+        return None, None
+
+
+async def get_user_data(client: httpx.AsyncClient, user_id: int) -> dict:
+    """Получение пользователя из Redmine"""
+    _, user_data = await fetch_user(client, user_id)
+    return user_data
+
+
+async def get_users_page(client: httpx.AsyncClient, offset: int, limit: int = REDMINE_PAGE_SIZE, params: dict = None) -> dict:
+    """Получение страницы справочника пользователей /users.json"""
+    response = await request(client, "/users.json", params={**(params or {}), 'offset': offset, 'limit': limit})
+    response.raise_for_status()
+    return response.json()
+
+
+async def list_users(client: httpx.AsyncClient, params: dict = None, concurrency: int = REDMINE_CONCURRENCY,
+                     on_page: Optional[Callable[[List[dict], int], Awaitable]] = None) -> List[dict]:
+    """Получение всего справочника пользователей постранично (limit/offset)
+
+    Кастомные поля (город, отдел, должность) Redmine отдаёт в списке так же, как в /users/{id}.json.
+    on_page — корутина, которая получает каждую страницу и total_count.
+    """
+    first_page = await get_users_page(client, 0, params=params)
+    total_count = first_page.get('total_count', 0)
+    users = list(first_page.get('users', []))
+    if on_page:
+        await on_page(first_page.get('users', []), total_count)
+
+    async def fetch_page(offset: int):
+        page = await get_users_page(client, offset, params=params)
+        users.extend(page.get('users', []))
+        if on_page:
+            await on_page(page.get('users', []), total_count)
+
+    # Первая страница даёт total_count, остальные можно забирать параллельно
+    await run_concurrently(fetch_page, range(REDMINE_PAGE_SIZE, total_count, REDMINE_PAGE_SIZE), concurrency)
+    logger.info(f"Получено {len(users)} из {total_count} пользователей Redmine")
+    return users
+
+
+async def run_concurrently(func: Callable[[int], Awaitable], items: Iterable[int], concurrency: int = REDMINE_CONCURRENCY):
+    """Обработка элементов пулом из concurrency корутин"""
+    items = iter(items)
+
+    async def worker():
+        # Итератор общий для всех воркеров, поэтому каждый элемент обрабатывается один раз
+        for item in items:
+            await func(item)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
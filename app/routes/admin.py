@@ -1,30 +1,31 @@
+import asyncio
 import secrets
 import os
-import sqlite3
-import json
-import redis
 
-from fastapi import APIRouter, BackgroundTasks, Request
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Request
+from fastapi.responses import HTMLResponse, StreamingResponse
 
-from ..models import LoginRequest, TokenRequest, UserRange, SheetTask
-from ..services import process_users, process_sheet_update, get_google_sheet, update_map_data_cache
-from ..database import get_unique_visitors, get_total_visits
-from ..config import ADMIN_PASSWORD, logger, DB_PATH
-from ..state import admin_token_store, progress_store
+from ..models import LoginRequest, TokenRequest, UserRange, SheetTask, SyncTask, CityCoordinates, CityAlias
+from ..services import update_map_data_cache, update_map_cities
+from ..database import (get_unique_visitors, get_total_visits, get_rejected_stats, clear_rejected, get_import_job,
+                        get_import_jobs, load_city_coordinates, save_city_coordinates, delete_city_coordinates,
+                        load_city_aliases, save_city_alias, delete_city_alias, count_employees, db_read, db_write)
+from ..cities import reload_city_index, renormalize_employees
+from ..config import ADMIN_PASSWORD, logger
+from ..state import admin_token_store
+from ..progress import load_progress, save_progress, progress_events
+from ..jobs import enqueue_job, get_job
+from ..ratelimit import limiter_stats
 
 
 router = APIRouter()
 
-# Инициализация Redis-клиента
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
-
 
 @router.get("/admin_stats")
 async def get_admin_stats(date_start: str, date_end: str):
     """Эндпоинт статистики посещений"""
-    unique_visitors = get_unique_visitors(date_start, date_end)
-    total_visits = get_total_visits(date_start, date_end)
+    unique_visitors, total_visits = await asyncio.gather(db_read(get_unique_visitors, date_start, date_end),
+                                                         db_read(get_total_visits, date_start, date_end))
     return {"unique_visitors": unique_visitors, "total_visits": total_visits}
 
 
@@ -63,7 +64,7 @@ async def get_admin_panel(request: Request):
 
 
 @router.post("/add_users")
-async def add_users(user_range: UserRange, background_tasks: BackgroundTasks):
+async def add_users(user_range: UserRange):
     """Эндпроинт добавления пользователй в БД"""
     start_id = user_range.start_id
     end_id = user_range.end_id
@@ -73,40 +74,97 @@ async def add_users(user_range: UserRange, background_tasks: BackgroundTasks):
         logger.warning(f"Invalid range {start_id}-{end_id} for task {task_id}")
         return {"message": "Некорректный диапазон ID", "status": "error"}
 
-    background_tasks.add_task(process_users, start_id, end_id, task_id)
+    enqueue_job('process_users', task_id, start_id=start_id, end_id=end_id, task_id=task_id, force=user_range.force)
     logger.info(f"Scheduled background task {task_id} for range {start_id}-{end_id}")
     return {"message": "Обработка запущена", "task_id": task_id, "status": "success"}
 
 
+@router.get("/rejected_users")
+async def get_rejected_users():
+    """Количество ID в негативном кэше по причинам"""
+    return await db_read(get_rejected_stats)
+
+
+@router.delete("/rejected_users")
+async def delete_rejected_users():
+    """Полный сброс негативного кэша"""
+    await db_write(clear_rejected)
+    return {"status": "success"}
+
+
+@router.post("/sync_users")
+async def sync_users_endpoint(task: SyncTask):
+    """Эндпоинт синхронизации всего справочника пользователей Redmine"""
+    enqueue_job('sync_users', task.task_id, task_id=task.task_id, incremental=task.incremental)
+    logger.info(f"Scheduled directory sync task {task.task_id}, incremental={task.incremental}")
+    return {"message": "Синхронизация запущена", "task_id": task.task_id, "status": "success"}
+
+
+@router.get("/import_jobs")
+async def list_import_jobs():
+    """Последние задачи импорта с контрольными точками"""
+    return await db_read(get_import_jobs)
+
+
+@router.post("/resume_import/{task_id}")
+async def resume_import(task_id: str):
+    """Эндпоинт продолжения прерванного импорта с последней контрольной точки"""
+    job = await db_read(get_import_job, task_id)
+    if not job:
+        return {"message": "Задача не найдена", "status": "error"}
+    if job['status'] not in ('interrupted', 'failed'):
+        return {"message": f"Задачу в статусе {job['status']} нельзя продолжить", "status": "error"}
+    queued = get_job(task_id)
+    if queued and queued['status'] in ('queued', 'running'):
+        # Воркер уже вернул прерванную задачу в очередь, она продолжится сама
+        return {"message": "Задача уже в очереди", "status": "error"}
+
+    # Ошибка прошлого запуска в прогрессе иначе сразу закрыла бы поток событий
+    save_progress(task_id, {
+        "progress": job['processed'],
+        "status": "running",
+        "error": None,
+        "message": None,
+        "added_count": job['added_count'],
+        "skipped_count": job['skipped_count'],
+        "error_count": len(job['errors'])
+    })
+    enqueue_job('process_users', task_id, start_id=job['start_id'], end_id=job['end_id'], task_id=task_id, resume=True)
+    logger.info(f"Resuming task {task_id} from ID {job['last_id'] + 1}")
+    return {"message": "Обработка продолжена", "task_id": task_id, "status": "success",
+            "start_id": job['start_id'], "end_id": job['end_id']}
+
+
 @router.get("/progress/{task_id}")
 async def get_progress(task_id: str):
     """Получение прогресса поиска сотрудников"""
-    progress = progress_store.get(task_id, {'progress': 0, 'error': None, 'message': None, 'added_count': 0})
+    progress = load_progress(task_id) or {'progress': 0, 'error': None, 'message': None, 'added_count': 0}
     logger.debug(f"Progress requested for task {task_id}: {progress}")
     return progress
 
 
+@router.get("/progress/{task_id}/events")
+async def stream_progress(task_id: str):
+    """Поток прогресса задачи (Server-Sent Events) до её завершения"""
+    return StreamingResponse(progress_events(task_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @router.post("/update_from_sheet")
-async def update_from_sheet(task: SheetTask, background_tasks: BackgroundTasks):
+async def update_from_sheet(task: SheetTask):
     """Эндпоинт загрузки данных из гугл таблицы"""
     try:
-        sheet = get_google_sheet()
-        all_records = sheet.get_all_records()
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM employees")
-        db_ids = [row[0] for row in cursor.fetchall()]
-        conn.close()
-
-        redis_client.set(task.task_id, json.dumps({
+        total_users = await db_read(count_employees)
+
+        save_progress(task.task_id, {
             "processed": 0,
-            "total": len(db_ids),
+            "total": total_users,
             "message": "",
             "error": False
-        }))
+        })
 
-        background_tasks.add_task(process_sheet_update, db_ids, all_records, task.task_id)
-        return {"status": "success", "total_users": len(db_ids), "task_id": task.task_id}
+        enqueue_job('process_sheet_update', task.task_id, task_id=task.task_id, force=task.force)
+        return {"status": "success", "total_users": total_users, "task_id": task.task_id}
     except Exception as e:
         logger.error(f"Sheet update error: {str(e)}")
         return {"status": "error", "message": str(e)}
@@ -115,13 +173,81 @@ async def update_from_sheet(task: SheetTask, background_tasks: BackgroundTasks):
 @router.get("/sheet_progress/{task_id}")
 async def get_sheet_progress(task_id: str):
     """Получение прогресса по обновлению данных из Google Sheets"""
-    progress = json.loads(redis_client.get(task_id) or '{"processed": 0, "error": True, "message": "Task not found"}')
+    progress = load_progress(task_id) or {"processed": 0, "error": True, "message": "Task not found"}
     logger.debug(f"Sheet progress requested for task {task_id}: {progress}")
     return progress
 
 
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Статус фоновой задачи в очереди"""
+    return get_job(job_id) or {"status": "not_found"}
+
+
+@router.get("/city_coordinates")
+async def list_city_coordinates():
+    """Сохранённые координаты городов"""
+    return await db_read(load_city_coordinates)
+
+
+@router.post("/city_coordinates")
+async def override_city_coordinates(city_coordinates: CityCoordinates):
+    """Ручное задание координат города (не устаревает и не запрашивается у геокодера)"""
+    await db_write(save_city_coordinates, city_coordinates.city, [city_coordinates.lat, city_coordinates.lon],
+                   'override', is_override=True)
+    await db_write(reload_city_index)
+    await update_map_cities([city_coordinates.city])
+    logger.info(f"Coordinates for {city_coordinates.city} overridden: {city_coordinates.lat}, {city_coordinates.lon}")
+    return {"status": "success"}
+
+
+@router.delete("/city_coordinates/{city}")
+async def remove_city_coordinates(city: str):
+    """Удаление координат города; город ищется заново (справочник или геокодер)"""
+    if not await db_write(delete_city_coordinates, city):
+        return {"status": "error", "message": "Город не найден"}
+    await update_map_cities([city])
+    return {"status": "success"}
+
+
+@router.get("/city_aliases")
+async def list_city_aliases():
+    """Синонимы городов"""
+    return await db_read(load_city_aliases)
+
+
+@router.post("/city_aliases")
+async def add_city_alias(city_alias: CityAlias):
+    """Добавление синонима города; города сотрудников пересчитываются, карта пересобирается"""
+    await db_write(save_city_alias, city_alias.alias, city_alias.city)
+    await db_write(reload_city_index)
+    changed = await db_write(renormalize_employees)
+    if changed:
+        await update_map_data_cache()
+    logger.info(f"City alias added: {city_alias.alias} -> {city_alias.city}, {changed} employees changed")
+    return {"status": "success", "changed_count": changed}
+
+
+@router.delete("/city_aliases/{alias}")
+async def remove_city_alias(alias: str):
+    """Удаление синонима города"""
+    if not await db_write(delete_city_alias, alias):
+        return {"status": "error", "message": "Синоним не найден"}
+    await db_write(reload_city_index)
+    changed = await db_write(renormalize_employees)
+    if changed:
+        await update_map_data_cache()
+    return {"status": "success", "changed_count": changed}
+
+
 @router.get("/refresh_cache")
 async def refresh_cache():
     """Эндпоинт ручного обновления кэша карты"""
-    update_map_data_cache()
+    await update_map_data_cache()
     return {"message": "Map data cache refreshed"}
+
+
+@router.get("/rate_limits")
+async def get_rate_limits():
+    """Текущие скорости запросов к внешним сервисам и события троттлинга"""
+    return limiter_stats()
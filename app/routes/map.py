@@ -1,51 +1,113 @@
 import os
 import secrets
-import asyncio
-import json
-import redis
+import hashlib
 
-from fastapi import APIRouter, WebSocket, Request
-from fastapi.responses import HTMLResponse
+from typing import List, Optional
 
-from ..services import update_map_data_cache
-from ..database import record_visit
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Request, Query
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+
+from ..services import (update_map_data_cache, get_map_payload, get_city_employees,
+                        get_map_clusters_payload, get_filtered_map, get_map_snapshot)
+from ..database import search_employees, db_read
 from ..config import logger
-from ..state import map_data_cache
+from ..live import broadcaster
+from ..visits import visit_recorder
 
 
 router = APIRouter()
 
-# Инициализация Redis-клиента
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+
+def accepted_encodings(header: str) -> set:
+    """Кодировки из Accept-Encoding (без q=0)"""
+    encodings = set()
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Совпадает ли ETag с If-None-Match запроса"""
+    if_none_match = request.headers.get('if-none-match', '')
+    return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+
+
+def payload_response(request: Request, payload: dict) -> Response:
+    """Ответ из готовых байтов: 304 по ETag, иначе br/gzip по Accept-Encoding"""
+    etag = payload['etag'].decode()
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    encodings = accepted_encodings(request.headers.get('accept-encoding', ''))
+    for encoding in ('br', 'gzip'):
+        if encoding in payload and encoding in encodings:
+            headers['Content-Encoding'] = encoding
+            return Response(content=payload[encoding], media_type='application/json', headers=headers)
+    return Response(content=payload['identity'], media_type='application/json', headers=headers)
 
 
 @router.get("/map_data")
-async def get_map_data():
-    """Эндпоинт получения данных карты"""
-    cached_data = redis_client.get("map_data_cache")
-    data = json.loads(cached_data) if cached_data else []
-    logger.info(f"map_data_cache in /map_data: {data}")
-    return data
+async def get_map_data(request: Request):
+    """Эндпоинт индекса маркеров карты: город, координаты, число сотрудников, версия (готовые сжатые байты, 304 по ETag)"""
+    return payload_response(request, get_map_payload())
+
+
+@router.get("/map_data/{city}")
+async def get_city_data(city: str, request: Request):
+    """Эндпоинт списка сотрудников города для сайдбара (из кэша, 304 по ETag)"""
+    body = get_city_employees(city)
+    if body is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Город не найден"})
+    etag = f'"{hashlib.sha256(body.encode()).hexdigest()[:32]}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+
+@router.get("/map_clusters")
+async def get_clusters(bbox: str, zoom: int, request: Request):
+    """Эндпоинт кластеров маркеров в видимой области: bbox=lat1,lon1,lat2,lon2 (юго-запад, северо-восток), 304 по ETag"""
+    try:
+        south, west, north, east = (float(value) for value in bbox.split(','))
+    except ValueError:
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Некорректный bbox"})
+    return payload_response(request, get_map_clusters_payload(zoom, south, west, north, east))
+
+
+@router.get("/map_filter")
+async def get_map_filter(department: Optional[List[str]] = Query(None), position: Optional[List[str]] = Query(None)):
+    """Эндпоинт маркеров по фильтрам отдела и должности (параметры повторяются) со счётчиками значений фильтров"""
+    return get_filtered_map({'department': department, 'position': position})
+
+
+@router.get("/search")
+async def search(q: str, limit: int = 10):
+    """Эндпоинт поиска сотрудников (автодополнение по префиксам слов) с координатами города"""
+    return await db_read(search_employees, q, max(1, min(limit, 50)))
 
 
 @router.websocket("/ws/map")
 async def websocket_map(websocket: WebSocket):
-    """Эндпоинт передачи данных на карту"""
+    """Эндпоинт подписки на карту: снимок всех маркеров одним сообщением, затем изменения городов"""
     await websocket.accept()
+    await broadcaster.connect(websocket)
     try:
-        cached_data = redis_client.get("map_data_cache")
-        data = json.loads(cached_data) if cached_data else []
-        for marker_data in data:
-            await websocket.send_json(marker_data)
-            logger.info(f"Отправлены кэшированные данные для города {marker_data['city']}")
-            await asyncio.sleep(0.005)
-        await websocket.send_json({'status': 'complete'})
-        logger.info("Все кэшированные данные карты отправлены")
+        await websocket.send_text(get_map_snapshot())
+        # Клиент ничего не присылает; ждём, пока он отключится
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
         logger.error(f"Ошибка в WebSocket: {e}")
-        await websocket.send_json({'status': 'error', 'message': str(e)})
     finally:
-        await websocket.close()
+        broadcaster.disconnect(websocket)
 
 
 @router.get("/map", response_class=HTMLResponse)
@@ -67,12 +129,12 @@ async def track_visit(request: Request):
     else:
         response = HTMLResponse(content="Карта сотрудников", status_code=200)
 
-    record_visit(visitor_id)
+    visit_recorder.record(visitor_id)      # Запись в базу — пачкой в фоне
     return response
 
 
 @router.get("/refresh_cache")
 async def refresh_cache():
     """Эндпоинт ручного обновления кэша карты"""
-    update_map_data_cache()
+    await update_map_data_cache()
     return {"message": "Map data cache refreshed"}
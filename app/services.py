@@ -1,114 +1,260 @@
+import asyncio
+import gzip
+import hashlib
 import json
-import requests
-import geocoder
-import time
-import gspread
-import sqlite3
 import redis
 
-from typing import List, Dict
-from oauth2client.service_account import ServiceAccountCredentials
-
-from .config import REDMINE_URL, API_KEY, GOOGLE_SHEET_KEY, CREDENTIALS_FILE, logger, REDIS_HOST
-from .database import get_or_fetch_user_data, get_all_employees
-from .state import map_data_cache, progress_store
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import brotli
+except ImportError:     # без brotli карта отдаётся в gzip
+    brotli = None
+
+from .config import (logger, REDIS_HOST, REDMINE_CONCURRENCY, CORPORATE_DOMAIN,
+                     DB_BATCH_SIZE, CLUSTER_MAX_ZOOM, SHEETS_SKIP_UNCHANGED)
+from .database import (get_existing_ids, parse_employee, upsert_employees, delete_employees, save_import_batch,
+                       create_import_job, get_import_job, set_import_job_status, get_rejected_ids, clear_rejected,
+                       get_sync_state, set_sync_state, get_all_employees, load_city_coordinates, get_employees_by_city,
+                       get_employee_city_ids, get_employee_assignments, update_employee_assignments, db_read, db_write)
+from .redmine import create_client, fetch_user, list_users, run_concurrently
+from .sheets import get_sheet_records
+from .geocoding import resolve_coordinates
+from .cities import refresh_city_index
+from .progress import ProgressPublisher
+from .clusters import build_clusters, clusters_in_bbox
+from .facets import FacetIndex, city_postings
 
 # Инициализация Redis-клиента
 redis_client = redis.Redis(host=REDIS_HOST, db=0, decode_responses=True)
 
+# Клиент для готовых (сжатых) ответов: байты без декодирования
+redis_bytes_client = redis.Redis(host=REDIS_HOST, db=0)
 
-def get_user_data(user_id: int) -> dict:
-    """Получени пользователей из Redmine"""
-    url = f"{REDMINE_URL}/users/{user_id}.json"
-    headers = {'X-Redmine-API-Key': API_KEY}
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching data for user {user_id}: {e}")
-        return None
+# Кэш карты: хэш город -> JSON маркера и счётчик версий, который растёт при каждом изменении
+MAP_CITIES_KEY = "map:cities"
+MAP_VERSION_KEY = "map:version"
 
+# Списки сотрудников для сайдбара: хэш город -> JSON, запрашиваются по клику на маркер
+MAP_EMPLOYEES_KEY = "map:employees"
 
-def clean_city_name(city):
-    """Поправление название города"""
-    if not city:
-        return None
-    city = city.strip()
-    if city in ["No city", "Ввести город", "Город проживания"]:
-        return None
-    mapping = {
-        "Санкт Петербург": "Санкт-Петербург",
-        "г. Петергоф, г. Санкт-Петербург": "Санкт-Петербург",
-        "Пермь/Санкт-Петербург": "Санкт-Петербург",
-        "Электросталь (МО)": "Электросталь",
-        "Орехово-Зуево, Московская обл.": "Орехово-Зуево",
-        "Пушкино, Московская область": "Пушкино",
-        "Белград, Сербия": "Белград",
-        "Нови Сад, Сербия": "Нови Сад",
-    }
-    return mapping.get(city, city)
+# Готовый ответ /map_data: identity, gzip, br и etag
+MAP_PAYLOAD_KEY = "map:payload"
+
+# Кластеры маркеров по уровням масштаба: хэш zoom -> JSON списка кластеров и version
+MAP_CLUSTERS_KEY = "map:clusters"
+
+# Маски сотрудников города по отделам и должностям: хэш город -> JSON; map:facets:version — версия карты,
+# с которой записаны маркеры и маски (меняется в одной транзакции с ними)
+MAP_FACETS_KEY = "map:facets"
+MAP_FACETS_VERSION_KEY = "map:facets:version"
+
+# Канал изменений карты: после записи городов публикуется готовый JSON {'type': 'diff', 'version', 'markers', 'removed'}
+MAP_CHANGES_CHANNEL = "map:changes"
 
+# Индекс фильтров последней версии в памяти процесса API
+_facets_cache = {'version': None, 'index': None}
 
-def get_coordinates(city: str, cache: dict) -> list:
-    """Получение координад города"""
-    if not city or city == "No city":
-        logger.warning(f"Город '{city}' пропущен")
+# Разобранные кластеры последней версии в памяти процесса API:
+# {'version', 'zooms': {zoom: (кластеры, долготы)}, 'payloads': {(zoom, bbox): готовый ответ /map_clusters}}
+_clusters_cache = {'version': None, 'zooms': {}, 'payloads': {}}
+
+# Сколько готовых ответов /map_clusters (по масштабу и bbox) хранить для текущей версии кластеров
+CLUSTER_PAYLOADS_LIMIT = 256
+
+# Ключ отметки последнего updated_on из справочника Redmine
+USERS_HIGH_WATER_MARK = "users_updated_on"
+
+# Ключ состояния последнего обновления из Google Sheets: время изменения таблицы и отпечаток списка сотрудников
+SHEET_SYNC_STATE = "sheet_sync"
+
+
+def rejection_reason(status_code, user_data):
+    """Причина, по которой ID не попадает в базу (None, если это сотрудник или ошибка временная)"""
+    if status_code == 404:
+        return 'not_found'
+    if not user_data:
         return None
-    # Если координаты уже в кэше, возвращаем их
-    if city in cache:
-        return cache[city]
-    # Запрос к геокодеру
-    g = geocoder.osm(city, headers={'User-Agent': 'FT_map/1.0 (imatveev@futuretoday.ru)'})
-    if g.ok:
-        cache[city] = g.latlng
-        logger.info(f"Координаты для города {city}: {g.latlng}")
-        return g.latlng
-    logger.warning(f"Город {city} не найден в геокодере")
+    user = user_data['user']
+    if not (user.get('mail') or '').endswith(CORPORATE_DOMAIN):
+        return 'external'
+    if user.get('status', 1) != 1:
+        return 'locked'
     return None
 
 
-def process_users(start_id: int, end_id: int, task_id: str):
-    """Фильтрация пользователй FT"""
-    logger.info(f"Starting background task {task_id} for range {start_id}-{end_id}")
-    progress_store[task_id] = {'progress': 0, 'error': None, 'message': None, 'added_count': 0}
-    added_count = 0
+async def process_users(start_id: int, end_id: int, task_id: str, force: bool = False, resume: bool = False,
+                        concurrency: int = REDMINE_CONCURRENCY):
+    """Фильтрация пользователй FT
+
+    ID из негативного кэша пропускаются; force=True сбрасывает кэш для диапазона и проверяет их заново.
+    Диапазон обрабатывается пачками, после каждой сохраняется контрольная точка;
+    resume=True продолжает задачу task_id с последней контрольной точки.
+    """
+    job = await db_read(get_import_job, task_id) if resume else None
+    if resume and not job:
+        logger.warning(f"Task {task_id}: No checkpoint to resume, starting from scratch")
+    if job:
+        start_id, end_id = job['start_id'], job['end_id']
+    first_id = job['last_id'] + 1 if job else start_id
+    logger.info(f"Starting background task {task_id} for range {first_id}-{end_id}, force={force}, resume={resume}")
+    progress = ProgressPublisher(task_id)
+    progress.set(
+        progress=job['processed'] if job else 0,
+        status='running',
+        error=None,
+        message=None,
+        added_count=job['added_count'] if job else 0,
+        skipped_count=job['skipped_count'] if job else 0,
+        error_count=len(job['errors']) if job else 0
+    )
+    errors = job['errors'] if job else []
+
+    async def process_user(user_id: int):
+        status_code, user_data = await fetch_user(client, user_id)
+        reason = rejection_reason(status_code, user_data)
+        if reason:
+            # Запоминаем отказ, чтобы следующие импорты не запрашивали этот ID
+            rejections.append((user_id, reason))
+        elif user_data:
+            row = parse_employee(user_data['user'])
+            rows.append(row)
+            progress.incr('added_count')
+        else:
+            errors.append({'id': user_id, 'status': status_code})
+            progress.incr('error_count')
+        progress.incr('progress')
+        logger.debug(f"Task {task_id}: Processed user {user_id}, progress {progress['progress']}, added {progress['added_count']}")
 
     try:
-        for user_id in range(start_id, end_id + 1):
-            user_data = get_or_fetch_user_data(user_id)
-            # отбираем тольок пользователей по корпоративной почте
-            if user_data and user_data['user'].get('mail') and user_data['user']['mail'].endswith('@futuretoday.ru'):    
-                added_count += 1
-            progress_store[task_id]['progress'] += 1
-            progress_store[task_id]['added_count'] = added_count
-            logger.debug(f"Task {task_id}: Processed user {user_id}, progress {progress_store[task_id]['progress']}, added {added_count}")
-            time.sleep(0.5)
-
-        logger.info(f"Task {task_id}: Added {added_count} new employees from range {start_id}-{end_id}")
-        update_map_data_cache()     # Обновляем кэш после добавления сотрудников
+        if job:
+            await db_write(set_import_job_status, task_id, 'running')
+        else:
+            await db_write(create_import_job, task_id, start_id, end_id)
+        if job:
+            # Пачки, записанные до сбоя, могли не попасть на карту: пересобираем их города
+            saved_ids = await db_read(get_existing_ids, start_id, job['last_id'])
+            await update_map_cities((await db_read(get_employee_city_ids, saved_ids)).values())
+        if force:
+            await db_write(clear_rejected, first_id, end_id)
+        # Уже сохранённые и отклонённые ID получаем одним запросом на каждый вид
+        existing_ids, rejected_ids = await asyncio.gather(db_read(get_existing_ids, first_id, end_id),
+                                                          db_read(get_rejected_ids, first_id, end_id))
+
+        async with create_client(concurrency=concurrency) as client:
+            for chunk_start in range(first_id, end_id + 1, DB_BATCH_SIZE):
+                chunk_end = min(chunk_start + DB_BATCH_SIZE - 1, end_id)
+                user_ids, existing_count, rejected_count = [], 0, 0
+                for user_id in range(chunk_start, chunk_end + 1):
+                    if user_id in existing_ids:
+                        existing_count += 1
+                    elif user_id in rejected_ids:
+                        rejected_count += 1
+                    else:
+                        user_ids.append(user_id)
+                progress.incr('added_count', existing_count)
+                progress.incr('skipped_count', rejected_count)
+                progress.incr('progress', existing_count + rejected_count)
+
+                rows, rejections = [], []
+                # Синонимы могли измениться в другом процессе, пока шёл импорт
+                await db_read(refresh_city_index)
+                await run_concurrently(process_user, user_ids, concurrency)
+                await db_write(save_import_batch, rows, rejections, checkpoint={
+                    'task_id': task_id,
+                    'last_id': chunk_end,
+                    'processed': progress['progress'],
+                    'added_count': progress['added_count'],
+                    'skipped_count': progress['skipped_count'],
+                    'errors': errors[-100:]
+                })
+                # Города пачки обновляются сразу после записи: если импорт упадёт позже, сотрудники уже на карте
+                await update_map_cities(row[6] for row in rows)
+
+        await db_write(set_import_job_status, task_id, 'completed')
+        logger.info(f"Task {task_id}: Added {progress['added_count']} new employees from range {start_id}-{end_id}")
+        progress.set(status='completed')
+        progress.flush()
 
     except Exception as e:
-        progress_store[task_id]['error'] = True
-        progress_store[task_id]['message'] = str(e)
+        progress.set(error=True, message=str(e))
+        progress.flush()
+        await db_write(set_import_job_status, task_id, 'failed', str(e))
         logger.error(f"Task {task_id}: Error processing users: {e}")
+        raise   # Задача должна завершиться со статусом failed
+
+
+async def sync_users(task_id: str, incremental: bool = False):
+    """Синхронизация справочника пользователей Redmine без перебора ID
+
+    В инкрементальном режиме обрабатываются только пользователи, изменённые после
+    сохранённой отметки updated_on; заблокированные удаляются из базы.
+    """
+    since = await db_read(get_sync_state, USERS_HIGH_WATER_MARK) if incremental else None
+    logger.info(f"Starting directory sync task {task_id}, incremental={incremental}, since={since}")
+    progress = ProgressPublisher(task_id)
+    progress.set(progress=0, total=0, status='running', error=None, message=None, added_count=0, changed_count=0)
+    high_water_mark = since or ''
+
+    # Для дельты нужны все статусы, чтобы заметить заблокированных
+    params = {'status': ''} if incremental else {'status': 1}
+    if since:
+        params['updated_on'] = f">={since}"
+
+    async def on_page(users: List[dict], total_count: int):
+        nonlocal high_water_mark
+        progress.set(total=total_count)
+        # Синонимы могли измениться в другом процессе, пока шла синхронизация
+        await db_read(refresh_city_index)
+        rows, removed_ids = [], []
+        for user in users:
+            updated_on = user.get('updated_on') or ''
+            high_water_mark = max(high_water_mark, updated_on)
+            if since and updated_on and updated_on < since:
+                continue
+            # отбираем только активных пользователей по корпоративной почте
+            row = parse_employee(user) if user.get('status', 1) == 1 else None
+            if row:
+                rows.append(row)
+            elif incremental:
+                removed_ids.append(user['id'])
+        # Города до изменения: сотрудник мог переехать или уйти
+        previous_cities = await db_read(get_employee_city_ids, [row[0] for row in rows] + removed_ids)
+        # Страница записывается одной транзакцией
+        changed = await db_write(upsert_employees, rows)
+        removed_count = await db_write(delete_employees, removed_ids)
+        progress.incr('progress', len(users))
+        progress.incr('added_count', len(rows))
+        progress.incr('changed_count', len(changed) + removed_count)
+        # Города страницы обновляются сразу после записи: при следующем запуске эти строки уже не изменятся
+        touched_cities = {row[6] for row in changed}
+        touched_cities.update(previous_cities.get(row[0]) for row in changed)
+        touched_cities.update(previous_cities.get(user_id) for user_id in removed_ids)
+        await update_map_cities(touched_cities)
+        logger.debug(f"Task {task_id}: Synced {progress['progress']}/{total_count}, changed {progress['changed_count']}")
+
+    try:
+        async with create_client() as client:
+            await list_users(client, params=params, on_page=on_page)
 
-    finally:
-        time.sleep(2)
-        logger.debug(f"Task {task_id}: Cleaning up progress_store")
-        progress_store.pop(task_id, None)
+        if high_water_mark:
+            await db_write(set_sync_state, USERS_HIGH_WATER_MARK, high_water_mark)
+        logger.info(f"Task {task_id}: {progress['changed_count']} employees changed, high-water mark {high_water_mark}")
+        progress.set(status='completed')
+        progress.flush()
 
+    except Exception as e:
+        progress.set(error=True, message=str(e))
+        progress.flush()
+        logger.error(f"Task {task_id}: Error syncing users: {e}")
+        raise   # Задача должна завершиться со статусом failed
 
-def update_map_data_cache():
-    """Обновлоение кэша данных карты"""
-    global map_data_cache
-    logger.info("Обновление кэша данных карты")
-    employees = get_all_employees()
-    city_employees = {}
-    coordinates_cache = {}
 
+def _group_by_city(employees: List[dict]) -> Dict[str, List[dict]]:
+    """Сотрудники по городам (city_id), отсортированные по имени"""
+    city_employees = {}
     for employee in employees:
-        city = clean_city_name(employee['city'])
+        city = employee['city_id']
         if city:
             if city not in city_employees:
                 city_employees[city] = []
@@ -123,29 +269,200 @@ def update_map_data_cache():
             city_employees[city].append(employee_data)
 
             logger.debug(f"Сгруппирован сотрудник {employee['name']} для города {city}")
-
-    map_data_cache = []
-    for city, emp_list in city_employees.items():
+    for emp_list in city_employees.values():
         emp_list.sort(key=lambda x: x['name'])
-        if city == "Москва":
-            coordinates = [55.778487, 37.672379]
-            logger.info(f"Используются заданные координаты для Москвы: {coordinates}")
-        else:
-            coordinates = get_coordinates(city, coordinates_cache)
-        if coordinates:
-            marker_data = {
-                'city': city,
-                'coordinates': coordinates,
-                'employees': emp_list
-            }
-            map_data_cache.append(marker_data)
-            logger.info(f"Добавлены данные в кэш для города {city} с {len(emp_list)} сотрудниками")
+    return city_employees
+
+
+async def _write_map_cities(employees: List[dict], cities: Iterable[str]):
+    """Запись маркеров городов в хэш карты; города без сотрудников или координат удаляются из него
+
+    Геокодирование новых городов ждёт сети в event loop, пока группировка и сортировка сотрудников идут в потоке.
+    """
+    coordinates_cache = await db_read(load_city_coordinates)
+    # Если геокодер ответит только при фоновом повторе, пересобирается лишь этот город
+    geocoding = asyncio.create_task(resolve_coordinates({employee['city_id'] for employee in employees},
+                                                        coordinates_cache,
+                                                        on_retry_success=lambda city: update_map_cities([city])))
+    city_employees = await asyncio.to_thread(_group_by_city, employees)
+    city_coordinates = await geocoding
+    # Версия записывается в маркер: по ней клиент понимает, что список сотрудников города устарел
+    version = redis_client.incr(MAP_VERSION_KEY)
+    markers, details, postings, removed = {}, {}, {}, []
+    for city in cities:
+        emp_list = city_employees.get(city)
+        coordinates = city_coordinates.get(city)
+        if emp_list and coordinates:
+            markers[city] = json.dumps({'city': city, 'coordinates': coordinates, 'count': len(emp_list),
+                                        'version': version})
+            details[city] = json.dumps({'city': city, 'version': version, 'employees': emp_list})
+            postings[city] = json.dumps(city_postings(emp_list))
+            logger.debug(f"Добавлены данные в кэш для города {city} с {len(emp_list)} сотрудниками")
         else:
-            logger.warning(f"Координаты для города {city} не найдены")
-
-    redis_client.set("map_data_cache", json.dumps(map_data_cache))
-    # logger.debug(f"map_data_cache: {map_data_cache}")
-    logger.info("Кэш данных карты успешно обновлён")
+            if emp_list:
+                logger.warning(f"Координаты для города {city} не найдены")
+            removed.append(city)
+
+    pipe = redis_client.pipeline()
+    if markers:
+        pipe.hset(MAP_CITIES_KEY, mapping=markers)
+        pipe.hset(MAP_EMPLOYEES_KEY, mapping=details)
+        pipe.hset(MAP_FACETS_KEY, mapping=postings)
+    if removed:
+        pipe.hdel(MAP_CITIES_KEY, *removed)
+        pipe.hdel(MAP_EMPLOYEES_KEY, *removed)
+        pipe.hdel(MAP_FACETS_KEY, *removed)
+    pipe.set(MAP_FACETS_VERSION_KEY, version)
+    pipe.execute()
+    _store_map_payload()
+    _store_map_clusters(version)
+    # Изменение сериализуется один раз, процессы API рассылают строку клиентам как есть
+    redis_client.publish(MAP_CHANGES_CHANNEL, f'{{"type": "diff", "version": {version}, '
+                                              f'"markers": [{",".join(markers.values())}], "removed": {json.dumps(removed)}}}')
+    logger.info(f"Кэш карты обновлён: {len(markers)} городов записано, {len(removed)} удалено, версия {version}")
+
+
+async def update_map_cities(cities: Iterable[str]):
+    """Пересборка маркеров только указанных городов"""
+    cities = {city for city in cities if city}
+    if not cities:
+        return
+    logger.info(f"Обновление кэша карты для {len(cities)} городов")
+    await _write_map_cities(await db_read(get_employees_by_city, list(cities)), cities)
+
+
+async def update_map_data_cache():
+    """Обновлоение кэша данных карты (полная пересборка всех городов)"""
+    logger.info("Обновление кэша данных карты")
+    employees = await db_read(get_all_employees)
+    # Города, которых больше нет в базе, тоже удаляем из хэша
+    cities = {employee['city_id'] for employee in employees if employee['city_id']}
+    await _write_map_cities(employees, cities | set(redis_client.hkeys(MAP_CITIES_KEY)))
+
+
+def _encode_payload(body: bytes, etag: str, gzip_level: int = 9, br_quality: int = 11) -> Dict[str, bytes]:
+    """Готовый ответ: {'identity', 'gzip', 'br' (если есть brotli), 'etag'}"""
+    payload = {
+        'identity': body,
+        'gzip': gzip.compress(body, compresslevel=gzip_level),
+        'etag': etag.encode(),
+    }
+    if brotli:
+        payload['br'] = brotli.compress(body, quality=br_quality)
+    return payload
+
+
+def _store_map_payload():
+    """Сериализация и сжатие ответа /map_data один раз на изменение карты"""
+    body = f"[{','.join(redis_client.hvals(MAP_CITIES_KEY))}]".encode()
+    payload = _encode_payload(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+    pipe = redis_bytes_client.pipeline()
+    pipe.delete(MAP_PAYLOAD_KEY)
+    pipe.hset(MAP_PAYLOAD_KEY, mapping=payload)
+    pipe.execute()
+
+
+def _store_map_clusters(version: int):
+    """Пересчёт кластеров всех уровней масштаба по текущим маркерам"""
+    clusters = build_clusters(get_map_markers())
+    mapping = {str(zoom): json.dumps(zoom_clusters) for zoom, zoom_clusters in clusters.items()}
+    mapping['version'] = version
+    pipe = redis_client.pipeline()
+    pipe.delete(MAP_CLUSTERS_KEY)
+    pipe.hset(MAP_CLUSTERS_KEY, mapping=mapping)
+    pipe.execute()
+
+
+def _load_map_clusters() -> str:
+    """Кластеры текущей версии в памяти процесса; возвращает версию"""
+    version = redis_client.hget(MAP_CLUSTERS_KEY, 'version')
+    if version is None:
+        # Кластеры ещё не считались с этой версии: считаем по текущим маркерам
+        _store_map_clusters(int(redis_client.get(MAP_VERSION_KEY) or 0))
+        version = redis_client.hget(MAP_CLUSTERS_KEY, 'version')
+    if _clusters_cache['version'] != version:
+        zooms = {}
+        for key, value in redis_client.hgetall(MAP_CLUSTERS_KEY).items():
+            if key != 'version':
+                zoom_clusters = json.loads(value)
+                zooms[int(key)] = (zoom_clusters, [cluster['coordinates'][1] for cluster in zoom_clusters])
+        _clusters_cache.update(version=version, zooms=zooms, payloads={})
+    return version
+
+
+def get_map_clusters(zoom: int, south: float, west: float, north: float, east: float) -> List[dict]:
+    """Готовые кластеры уровня zoom в пределах bbox"""
+    zoom = max(0, min(zoom, CLUSTER_MAX_ZOOM))
+    _load_map_clusters()
+    zoom_clusters, lons = _clusters_cache['zooms'].get(zoom, ([], []))
+    return clusters_in_bbox(zoom_clusters, south, west, north, east, lons)
+
+
+def get_map_clusters_payload(zoom: int, south: float, west: float, north: float, east: float) -> Dict[str, bytes]:
+    """Готовый ответ /map_clusters: {'identity', 'gzip', 'br' (если есть brotli), 'etag'}
+
+    ETag — версия кластеров, масштаб и bbox: повторный запрос той же области получает 304,
+    пока карта не изменилась. Сжатые ответы хранятся в памяти процесса до смены версии.
+    """
+    zoom = max(0, min(zoom, CLUSTER_MAX_ZOOM))
+    version = _load_map_clusters()
+    key = (zoom, south, west, north, east)
+    payloads = _clusters_cache['payloads']
+    if key not in payloads:
+        body = json.dumps(get_map_clusters(zoom, south, west, north, east)).encode()
+        etag = f'"{hashlib.sha256(f"{version}:{key}".encode()).hexdigest()[:32]}"'
+        if len(payloads) >= CLUSTER_PAYLOADS_LIMIT:
+            payloads.pop(next(iter(payloads)))
+        # Ответ по области считается на запросе, поэтому сжатие быстрее, чем у /map_data
+        payloads[key] = _encode_payload(body, etag, gzip_level=6, br_quality=5)
+    return payloads[key]
+
+
+def get_filtered_map(selected: Dict[str, Optional[List[str]]]) -> dict:
+    """Маркеры с числом сотрудников, подходящих под фильтры ({'department': [...], 'position': [...]}), и счётчики фильтров"""
+    version = redis_client.get(MAP_FACETS_VERSION_KEY)
+    if _facets_cache['version'] != version or _facets_cache['index'] is None:
+        pipe = redis_client.pipeline()
+        pipe.hgetall(MAP_CITIES_KEY)
+        pipe.hgetall(MAP_FACETS_KEY)
+        markers, postings = pipe.execute()
+        _facets_cache.update(version=version, index=FacetIndex(
+            {city: json.loads(marker) for city, marker in markers.items()},
+            {city: json.loads(city_facets) for city, city_facets in postings.items()}
+        ))
+    return _facets_cache['index'].filter(selected)
+
+
+def get_map_payload() -> Dict[str, bytes]:
+    """Готовый ответ /map_data: {'identity', 'gzip', 'br' (если есть brotli), 'etag'}"""
+    payload = {key.decode(): value for key, value in redis_bytes_client.hgetall(MAP_PAYLOAD_KEY).items()}
+    if not payload:
+        # Кэш ещё не собирался с этой версии: собираем ответ из текущих маркеров
+        _store_map_payload()
+        payload = {key.decode(): value for key, value in redis_bytes_client.hgetall(MAP_PAYLOAD_KEY).items()}
+    return payload
+
+
+def get_map_markers() -> List[dict]:
+    """Все маркеры карты из кэша"""
+    return [json.loads(marker) for marker in redis_client.hvals(MAP_CITIES_KEY)]
+
+
+def get_map_snapshot() -> str:
+    """Готовый JSON снимка карты для /ws/map: {'type': 'snapshot', 'version', 'markers'}
+
+    Маркеры и версия читаются в одной транзакции; изменения с версией не больше снимка клиент пропускает.
+    """
+    pipe = redis_client.pipeline()
+    pipe.get(MAP_FACETS_VERSION_KEY)
+    pipe.hvals(MAP_CITIES_KEY)
+    version, markers = pipe.execute()
+    return f'{{"type": "snapshot", "version": {int(version or 0)}, "markers": [{",".join(markers)}]}}'
+
+
+def get_city_employees(city: str):
+    """Готовый JSON сотрудников города для сайдбара: {'city', 'version', 'employees'} (None, если города нет на карте)"""
+    return redis_client.hget(MAP_EMPLOYEES_KEY, city)
 
 
 # Пока не нужен
@@ -156,59 +473,91 @@ def update_map_data_cache():
 #         await asyncio.sleep(3600)  # Обновление каждый час
 
 
-def get_google_sheet():
-    """Получение данных из гугл таблицы"""
-    scope = ['https://spreadsheets.google.com/feeds',
-             'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
-    client = gspread.authorize(creds)
-    return client.open_by_key(GOOGLE_SHEET_KEY).sheet1
+def _sheet_id(value):
+    """ID сотрудника из колонки «#» (число или строка с числом; иначе None)"""
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return None
+
+
+def diff_sheet_records(sheet_data: List[Dict[str, str]], db_rows: List[tuple]) -> dict:
+    """Сравнение таблицы с базой: только сотрудники, у которых отличаются отдел или должность
+
+    Таблица индексируется по «#» один раз; пустые значения в таблице и в базе считаются одинаковыми.
+    """
+    sheet_index = {}
+    for row in sheet_data:
+        user_id = _sheet_id(row.get("#", ""))
+        if user_id is not None:
+            sheet_index[user_id] = ((str(row.get("Отдел", "")).strip() or None),
+                                    (str(row.get("Должность", "")).strip() or None))
+    updates, changes, cities = [], [], set()
+    for user_id, department, position, city_id in db_rows:
+        new = sheet_index.get(user_id)
+        if new and new != (department or None, position or None):
+            updates.append((new[0], new[1], user_id))
+            changes.append({'id': user_id, 'department': [department, new[0]], 'position': [position, new[1]]})
+            cities.add(city_id)
+    db_ids = {row[0] for row in db_rows}
+    return {
+        'updates': updates,
+        'changes': changes,
+        'cities': cities,
+        'matched_count': len(db_ids & sheet_index.keys()),
+        'unknown_ids': sorted(sheet_index.keys() - db_ids),
+    }
+
 
+async def process_sheet_update(task_id: str, force: bool = False) -> dict:
+    """Обновление данных сотрудников (должность, отдел) по разнице между таблицей и базой
 
-def process_sheet_update(db_ids: List[int], sheet_data: List[Dict[str, str]], task_id: str):
-    """Обновление данных сотрудников (должность, отдел)"""
+    Изменившиеся строки записываются одной транзакцией, на карте пересобираются только их города.
+    Если ни таблица, ни список сотрудников не менялись с прошлого обновления, таблица не скачивается
+    (SHEETS_SKIP_UNCHANGED; force=True скачивает её в любом случае).
+    Возвращает отчёт: сколько сотрудников найдено в таблице и изменено, какие именно и какие ID таблицы неизвестны;
+    ошибка пробрасывается дальше, чтобы задача получила статус failed.
+    """
+    progress = ProgressPublisher(task_id)
+    progress.set(processed=0, total=0, updated_count=0, message="", error=False)
     try:
-        from .database import DB_PATH
-        updated_count = 0
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-
-        for idx, user_id in enumerate(db_ids):
-            sheet_row = next((row for row in sheet_data if row["#"] == user_id), None)
-            if sheet_row:
-                cursor.execute("""
-                    UPDATE employees SET
-                    department = ?,
-                    position = ?
-                    WHERE id = ?
-                """, (
-                    sheet_row.get("Отдел", ""),
-                    sheet_row.get("Должность", ""),
-                    user_id
-                ))
-                updated_count += 1
-
-            # Улучшенное обновление прогресса в Redis
-            progress_data = json.loads(redis_client.get(task_id) or '{}')
-            progress_data["processed"] = idx + 1
-            progress_data["updated_count"] = updated_count
-            redis_client.set(task_id, json.dumps(progress_data))
-
-            time.sleep(0.1)
-
-        conn.commit()
-        progress_data = json.loads(redis_client.get(task_id) or '{}')
-        progress_data["message"] = f"Обновлено {updated_count} записей"
-        progress_data["status"] = "completed"
-        redis_client.set(task_id, json.dumps(progress_data))
-        logger.info(f"Обновлено {updated_count} записей")
+        db_rows = await db_read(get_employee_assignments)
+        progress.set(total=len(db_rows))
+        fingerprint = hashlib.sha256(','.join(str(row[0]) for row in sorted(db_rows)).encode()).hexdigest()
+        state = json.loads(await db_read(get_sync_state, SHEET_SYNC_STATE) or '{}')
+        # Новые сотрудники тоже требуют чтения таблицы, даже если она сама не менялась
+        modified_since = (state.get('modified_time') if SHEETS_SKIP_UNCHANGED and not force
+                          and state.get('employees') == fingerprint else None)
+        sheet_data, modified_time = await asyncio.to_thread(get_sheet_records, modified_since)
+        if sheet_data is None:
+            report = {'matched_count': 0, 'updated_count': 0, 'changes': [], 'unknown_ids': [], 'cities': [],
+                      'unchanged': True}
+            progress.set(processed=len(db_rows), report=report, message="Таблица не менялась", status="completed")
+            progress.flush()
+            logger.info(f"Google Sheet not modified since {modified_time}, update skipped")
+            return report
+
+        diff = diff_sheet_records(sheet_data, db_rows)
+        await db_write(update_employee_assignments, diff['updates'])
+        await update_map_cities(diff['cities'])
+        await db_write(set_sync_state, SHEET_SYNC_STATE, json.dumps({'modified_time': modified_time, 'employees': fingerprint}))
+
+        report = {
+            'matched_count': diff['matched_count'],
+            'updated_count': len(diff['changes']),
+            'changes': diff['changes'][:100],
+            'unknown_ids': diff['unknown_ids'][:100],
+            'cities': sorted(city for city in diff['cities'] if city),
+        }
+        progress.set(processed=len(db_rows), updated_count=report['updated_count'], report=report,
+                     message=f"Обновлено {report['updated_count']} записей", status="completed")
+        progress.flush()
+        logger.info(f"Обновлено {report['updated_count']} записей из {report['matched_count']} найденных в таблице, "
+                    f"{len(diff['unknown_ids'])} ID таблицы нет в базе")
+        return report
 
     except Exception as e:
-        progress_data = json.loads(redis_client.get(task_id) or '{}')
-        progress_data["error"] = True
-        progress_data["message"] = f"Ошибка: {str(e)}"
-        redis_client.set(task_id, json.dumps(progress_data))
+        progress.set(error=True, message=f"Ошибка: {str(e)}")
+        progress.flush()
         logger.error(f"Sheet update failed: {str(e)}")
-    finally:
-        time.sleep(5)
-        progress_store.pop(task_id, None)
+        raise   # Задача должна завершиться со статусом failed
@@ -0,0 +1,87 @@
+import threading
+import gspread
+
+from typing import Dict, List, Optional, Tuple
+
+from .config import GOOGLE_SHEET_KEY, CREDENTIALS_FILE, logger
+from .ratelimit import SHEETS_HOST, THROTTLE_STATUSES, ThrottledError, call_with_retry, parse_retry_after
+
+# Только чтение таблицы и её метаданных (время изменения)
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly',
+          'https://www.googleapis.com/auth/drive.metadata.readonly']
+
+# Колонки таблицы, которые нужны для обновления сотрудников
+SHEET_COLUMNS = ("#", "Отдел", "Должность")
+
+# Авторизованный клиент и лист создаются один раз на процесс; токен обновляет google-auth
+_worksheet: Optional[gspread.Worksheet] = None
+# Буквы колонок по заголовкам первой строки
+_column_letters: Dict[str, str] = {}
+_lock = threading.Lock()
+
+
+def get_worksheet() -> gspread.Worksheet:
+    """Первый лист таблицы через авторизованный клиент (credentials.json читается один раз)"""
+    global _worksheet
+    with _lock:
+        if _worksheet is None:
+            client = gspread.service_account(filename=CREDENTIALS_FILE, scopes=SCOPES)
+            _worksheet = client.open_by_key(GOOGLE_SHEET_KEY).sheet1
+            logger.info("Google Sheets client authorized")
+        return _worksheet
+
+
+def _resolve_columns(worksheet: gspread.Worksheet) -> Dict[str, str]:
+    """Буквы нужных колонок по строке заголовков"""
+    header = worksheet.row_values(1)
+    letters = {}
+    for name in SHEET_COLUMNS:
+        if name not in header:
+            raise ValueError(f"В таблице нет колонки «{name}»")
+        letters[name] = gspread.utils.rowcol_to_a1(1, header.index(name) + 1).rstrip('0123456789')
+    return letters
+
+
+def _read_columns(worksheet: gspread.Worksheet) -> List[Dict[str, str]]:
+    """Чтение только нужных колонок одним batch-запросом; при смене заголовков колонки ищутся заново"""
+    global _column_letters
+    for attempt in range(2):
+        if not _column_letters or attempt:
+            _column_letters = _resolve_columns(worksheet)
+        ranges = [f"{letter}1:{letter}" for letter in _column_letters.values()]
+        columns = [[row[0] if row else "" for row in value_range] for value_range in worksheet.batch_get(ranges)]
+        if [column[0] if column else "" for column in columns] == list(_column_letters):
+            break
+        logger.info("Колонки таблицы сдвинулись, заголовки читаются заново")
+    else:
+        raise ValueError("Не удалось найти колонки таблицы")
+
+    records = []
+    for i in range(1, max(len(column) for column in columns)):
+        record = {name: column[i] if i < len(column) else "" for name, column in zip(_column_letters, columns)}
+        if str(record["#"]).strip():
+            records.append(record)
+    return records
+
+
+def _fetch_sheet_records(modified_since: Optional[str]) -> Tuple[Optional[List[Dict[str, str]]], str]:
+    """Время изменения таблицы и её строки (None, если таблица не менялась); 429/503 превращаются в ThrottledError"""
+    try:
+        worksheet = get_worksheet()
+        modified_time = worksheet.spreadsheet.get_lastUpdateTime()
+        if modified_since and modified_time == modified_since:
+            return None, modified_time
+        return _read_columns(worksheet), modified_time
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code in THROTTLE_STATUSES:
+            raise ThrottledError(e.response.status_code, parse_retry_after(e.response.headers.get('Retry-After')))
+        raise
+
+
+def get_sheet_records(modified_since: Optional[str] = None) -> Tuple[Optional[List[Dict[str, str]]], str]:
+    """Строки таблицы («#», «Отдел», «Должность») через лимитер Google Sheets
+
+    Если время изменения таблицы совпадает с modified_since, строки не скачиваются и возвращается None.
+    Вызов блокирующий — из асинхронного кода его запускают в потоке.
+    """
+    return call_with_retry(SHEETS_HOST, _fetch_sheet_records, modified_since)
@@ -4,11 +4,5 @@ token_store = {}
 # Хранилище токенов для админ-панели
 admin_token_store = {}
 
-# Хранилище прогресса для задач Redmine
-progress_store = {}
-
 # Хранилище прогресса для задач Google Sheets
 sheets_progress_store = {}
-
-# Глобальный кэш для данных карты
-map_data_cache = []
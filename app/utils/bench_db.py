@@ -0,0 +1,84 @@
+"""Бенчмарк задержки event loop во время тяжёлого запроса статистики.
+
+Запуск из корня проекта:
+    python -m app.utils.bench_db --visits 2000000 --queries 3
+
+Пока выполняется COUNT(DISTINCT visitor_id) по таблице visits, event loop обслуживает
+лёгкие «запросы карты» (короткие корутины раз в 5 мс). Сравнивает вызов статистики прямо
+в обработчике (как было) с db_read, который выполняет запрос в пуле читателей.
+"""
+import argparse
+import asyncio
+import math
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("API_KEY", "bench")
+os.environ.setdefault("PASSWORD", "bench")
+os.environ.setdefault("ADMIN_PASSWORD", "bench")
+
+import app.database as database  # noqa: E402
+
+
+def prepare_db(path: str, visits: int):
+    """База с visits посещениями от visits // 10 посетителей"""
+    database.DB_PATH = path
+    database.init_db()
+    conn = database.get_connection()
+    with conn:
+        conn.executemany("INSERT INTO visits (visitor_id) VALUES (?)",
+                         ((f"visitor{i % max(visits // 10, 1)}",) for i in range(visits)))
+
+
+async def map_requests(done: asyncio.Event, interval: float = 0.005) -> list:
+    """Задержки лёгких запросов, пока идёт статистика: сколько корутина ждала своей очереди в event loop"""
+    latencies = []
+    while not done.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        latencies.append(time.perf_counter() - started - interval)
+    return latencies
+
+
+async def run(mode: str, queries: int) -> list:
+    done = asyncio.Event()
+
+    async def stats_handler():
+        await asyncio.sleep(0.01)
+        for _ in range(queries):
+            if mode == 'blocking':
+                database.get_unique_visitors('2000-01-01', '2100-01-01')
+            else:
+                await database.db_read(database.get_unique_visitors, '2000-01-01', '2100-01-01')
+        done.set()
+
+    latencies, _ = await asyncio.gather(map_requests(done), stats_handler())
+    return latencies
+
+
+def report(mode: str, latencies: list):
+    latencies = sorted(latencies)
+    p99 = latencies[math.ceil(len(latencies) * 0.99) - 1]
+    print(f"{mode:>9}: {len(latencies):4d} requests, median {statistics.median(latencies) * 1000:7.2f} ms, "
+          f"p99 {p99 * 1000:7.2f} ms, max {latencies[-1] * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--visits', type=int, default=2_000_000)
+    parser.add_argument('--queries', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_db(os.path.join(directory, "bench.db"), args.visits)
+        started = time.perf_counter()
+        database.get_unique_visitors('2000-01-01', '2100-01-01')
+        print(f"Запрос статистики: {(time.perf_counter() - started) * 1000:.0f} ms")
+        for mode in ('blocking', 'db_read'):
+            report(mode, asyncio.run(run(mode, args.queries)))
+
+
+if __name__ == "__main__":
+    main()
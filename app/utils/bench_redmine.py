@@ -0,0 +1,113 @@
+"""Бенчмарк загрузки пользователей Redmine на локальной заглушке.
+
+Запуск из корня проекта:
+    python -m app.utils.bench_redmine --count 200 --latency 0.05 --concurrency 1 5 10 20
+
+Сравнивает старый последовательный обход (requests.get без сессии + sleep)
+с асинхронным пулом из app.redmine.
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+import requests
+from aiohttp import web
+
+os.environ.setdefault("API_KEY", "bench")
+os.environ.setdefault("PASSWORD", "bench")
+os.environ.setdefault("ADMIN_PASSWORD", "bench")
+
+from app.redmine import create_client, get_user_data, run_concurrently  # noqa: E402
+from app.ratelimit import configure_limiter  # noqa: E402
+
+
+def make_stub_app(latency: float) -> web.Application:
+    """Заглушка Redmine: /users/{id}.json с задержкой, каждый 5-й ID отсутствует"""
+    async def user_handler(request):
+        user_id = int(request.match_info['user_id'])
+        await asyncio.sleep(latency)
+        if user_id % 5 == 0:
+            raise web.HTTPNotFound()
+        return web.json_response({'user': {
+            'id': user_id,
+            'firstname': 'Иван',
+            'lastname': f'Тестов {user_id}',
+            'mail': f'user{user_id}@futuretoday.ru',
+            'custom_fields': [{'name': 'Город проживания', 'value': 'Москва'}]
+        }})
+
+    app = web.Application()
+    app.router.add_get('/users/{user_id}.json', user_handler)
+    return app
+
+
+def start_stub(latency: float, port: int) -> str:
+    """Запуск заглушки в отдельном потоке со своим event loop"""
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    async def serve():
+        runner = web.AppRunner(make_stub_app(latency))
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        ready.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{port}"
+
+
+def bench_sequential(base_url: str, ids: range, delay: float) -> float:
+    """Старый путь: requests.get без переиспользования соединений и sleep после каждого ID"""
+    started = time.perf_counter()
+    for user_id in ids:
+        try:
+            requests.get(f"{base_url}/users/{user_id}.json", headers={'X-Redmine-API-Key': 'bench'}).raise_for_status()
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(delay)
+    return time.perf_counter() - started
+
+
+async def bench_async(base_url: str, ids: range, concurrency: int) -> float:
+    """Новый путь: пул keep-alive соединений и ограниченная конкурентность"""
+    started = time.perf_counter()
+    async with create_client(base_url=base_url, concurrency=concurrency) as client:
+        async def fetch(user_id):
+            await get_user_data(client, user_id)
+        await run_concurrently(fetch, ids, concurrency)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=200, help='Количество ID')
+    parser.add_argument('--latency', type=float, default=0.05, help='Задержка ответа заглушки, с')
+    parser.add_argument('--sleep', type=float, default=0.5, help='Пауза старого обхода после каждого ID, с')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 5, 10, 20])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rate', type=float, default=1000, help='Бюджет лимитера для заглушки, запросов в секунду')
+    args = parser.parse_args()
+
+    configure_limiter('127.0.0.1', args.rate)
+
+    base_url = start_stub(args.latency, args.port)
+    ids = range(1, args.count + 1)
+
+    sequential = bench_sequential(base_url, ids, args.sleep)
+    print(f"sequential (sleep {args.sleep}s): {sequential:.2f}s, {args.count / sequential:.1f} ids/s")
+    for concurrency in args.concurrency:
+        elapsed = asyncio.run(bench_async(base_url, ids, concurrency))
+        print(f"async concurrency={concurrency}: {elapsed:.2f}s, {args.count / elapsed:.1f} ids/s, "
+              f"x{sequential / elapsed:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import asyncio
+
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, List, Optional, Tuple
+
+from .config import VISIT_BATCH_SIZE, VISIT_FLUSH_INTERVAL, VISIT_BUFFER_SIZE, logger
+from .database import db_write, record_visits
+
+
+class VisitRecorder:
+    """Отложенная запись посещений карты
+
+    record() только добавляет посещение в кольцевой буфер; фоновая задача пишет буфер в базу
+    пачкой, когда набирается batch_size посещений или проходит interval секунд. Если база
+    не успевает, буфер не растёт дальше buffer_size: самые старые посещения отбрасываются.
+    """
+
+    def __init__(self, batch_size: int = VISIT_BATCH_SIZE, interval: float = VISIT_FLUSH_INTERVAL,
+                 buffer_size: int = VISIT_BUFFER_SIZE):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.buffer: Deque[Tuple[str, str]] = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, visitor_id: str):
+        """Добавление посещения (время фиксируется сейчас, в формате CURRENT_TIMESTAMP)"""
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((visitor_id, datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')))
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Запись всего накопленного в базу; пачка, которую не удалось записать, возвращается в начало буфера"""
+        while self.buffer:
+            batch = [self.buffer.popleft() for _ in range(min(len(self.buffer), self.batch_size))]
+            try:
+                await db_write(record_visits, batch)
+            except BaseException:
+                self._return_batch(batch)
+                raise
+        if self.dropped:
+            logger.warning(f"Буфер посещений переполнен, отброшено {self.dropped} посещений")
+            self.dropped = 0
+
+    def _return_batch(self, batch: List[Tuple[str, str]]):
+        """Возврат незаписанной пачки в начало буфера; если места нет, отбрасываются самые старые посещения"""
+        free = self.buffer.maxlen - len(self.buffer)
+        if len(batch) > free:
+            self.dropped += len(batch) - free
+            batch = batch[len(batch) - free:]
+        self.buffer.extendleft(reversed(batch))
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи посещений, {len(self.buffer)} посещений ждут следующей попытки: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка фоновой записи и запись оставшихся посещений
+
+        Фоновая задача не отменяется: она дописывает текущую пачку и выходит из цикла.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Не удалось записать {len(self.buffer)} посещений при остановке: {e}")
+
+
+visit_recorder = VisitRecorder()
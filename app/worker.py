@@ -0,0 +1,18 @@
+"""Воркер фоновых задач (импорт, синхронизация с Redmine, обновление из Google Sheets).
+
+Запуск из корня проекта (можно несколько экземпляров на разных ядрах или узлах с общей базой):
+    python -m app.worker
+"""
+import asyncio
+
+from .database import init_db
+from .jobs import run_worker
+
+
+async def main():
+    init_db()   # Инициализация базы данных
+    await run_worker()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
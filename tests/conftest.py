@@ -0,0 +1,42 @@
+import os
+
+import fakeredis
+import pytest
+import redis.asyncio
+
+# Обязательные переменные окружения config.py; тестам настоящие значения не нужны
+os.environ.setdefault("API_KEY", "test")
+os.environ.setdefault("PASSWORD", "test")
+os.environ.setdefault("ADMIN_PASSWORD", "test")
+# Координаты только из справочника и базы, без запросов к Nominatim
+os.environ.setdefault("NOMINATIM_ENABLED", "0")
+
+from app import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Пустая база во временном каталоге (соединение текущего потока открывается заново)"""
+    database.close_connection()
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / "test.db"))
+    database.init_db()
+    yield database
+    database.close_connection()
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Общий fakeredis вместо Redis во всех модулях (синхронные и асинхронные клиенты)"""
+    from app import jobs, progress, ratelimit, services
+
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    for module in (jobs, progress, ratelimit, services):
+        monkeypatch.setattr(module, 'redis_client', client)
+    monkeypatch.setattr(services, 'redis_bytes_client', fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(redis.asyncio, 'Redis',
+                        lambda *args, decode_responses=False, **kwargs:
+                        fakeredis.FakeAsyncRedis(server=server, decode_responses=decode_responses))
+    monkeypatch.setattr(services, '_facets_cache', {'version': None, 'index': None})
+    monkeypatch.setattr(services, '_clusters_cache', {'version': None, 'zooms': {}, 'payloads': {}})
+    return client
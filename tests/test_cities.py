@@ -0,0 +1,38 @@
+import time
+
+from app import cities
+
+
+def test_index_rebuilds_after_change_in_another_process(db):
+    cities.load_city_index()
+    assert cities.normalize_city("Питерск") == "Питерск"
+    assert not cities.refresh_city_index()
+
+    # Другой процесс (API) добавил синоним и сменил версию индекса
+    db.save_city_alias("Питерск", "Санкт-Петербург")
+    db.set_sync_state(cities.CITY_INDEX_VERSION, str(time.time_ns()))
+
+    assert cities.refresh_city_index()
+    assert cities.normalize_city("Питерск") == "Санкт-Петербург"
+
+
+def test_reload_city_index_bumps_version(db):
+    cities.load_city_index()
+    db.save_city_alias("Питерск", "Санкт-Петербург")
+    cities.reload_city_index()
+    assert cities.normalize_city("Питерск") == "Санкт-Петербург"
+    assert db.get_sync_state(cities.CITY_INDEX_VERSION) is not None
+    assert not cities.refresh_city_index()
+
+
+def test_abbreviation_does_not_match_another_city(db):
+    cities.load_city_index()
+    assert cities.normalize_city("Н. Новгород") == "Нижний Новгород"
+    assert cities.normalize_city("В. Новгород") == "Великий Новгород"
+    assert cities.normalize_city("Екатеринбур") == "Екатеринбург"
+
+
+def test_blank_city_is_unresolved(db):
+    cities.load_city_index()
+    assert cities.normalize_city("  ") is None
+    assert cities.normalize_city("—") is None
@@ -0,0 +1,53 @@
+import asyncio
+import math
+import time
+
+import httpx
+
+from app.main import app
+
+# Посещения в тестовой базе: COUNT(DISTINCT) по ним заметно дольше допустимой задержки карты
+VISITS = 1_000_000
+
+# Допустимая задержка запроса карты, пока идёт статистика
+P99_BOUND = 0.05
+
+MAP_REQUESTS = ("/map_data", "/search?q=Петров", "/map_clusters?bbox=40,20,70,60&zoom=4")
+
+
+def p99(latencies: list) -> float:
+    latencies = sorted(latencies)
+    return latencies[math.ceil(len(latencies) * 0.99) - 1]
+
+
+async def measure() -> tuple:
+    """Время /admin_stats и задержки запросов карты, отправленных, пока он выполняется"""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        for path in MAP_REQUESTS:
+            (await client.get(path)).raise_for_status()     # первый запрос собирает кэши
+
+        started = time.perf_counter()
+        stats = asyncio.create_task(client.get("/admin_stats", params={'date_start': '2000-01-01',
+                                                                       'date_end': '2100-01-01'}))
+        latencies = []
+        while not stats.done():
+            for path in MAP_REQUESTS:
+                request_started = time.perf_counter()
+                (await client.get(path)).raise_for_status()
+                latencies.append(time.perf_counter() - request_started)
+        response = await stats
+        return response.json(), time.perf_counter() - started, latencies
+
+
+def test_map_requests_stay_fast_during_stats_query(db, fake_redis):
+    db.upsert_employees([(1, "Иван Петров", "user1@futuretoday.ru", "Казань", None, None, "Казань")])
+    with db.get_connection() as conn:
+        conn.executemany("INSERT INTO visits (visitor_id) VALUES (?)",
+                         ((f"visitor{i % (VISITS // 10)}",) for i in range(VISITS)))
+
+    stats, stats_time, latencies = asyncio.run(measure())
+    assert stats == {'unique_visitors': VISITS // 10, 'total_visits': VISITS}
+    # Если бы статистика блокировала event loop, запрос карты ждал бы её целиком
+    assert stats_time > P99_BOUND
+    assert len(latencies) > 10
+    assert p99(latencies) < P99_BOUND
@@ -0,0 +1,23 @@
+import sqlite3
+
+import pytest
+
+
+ROW = (1, "Иван Петров", "user1@futuretoday.ru", "Москва", None, None, "Москва")
+
+
+def test_upsert_returns_only_changed_rows(db):
+    assert db.upsert_employees([ROW]) == [ROW]
+    assert db.upsert_employees([ROW]) == []
+
+
+def test_write_errors_are_raised(db):
+    db.upsert_employees([ROW])
+    with db.get_connection() as conn:
+        conn.execute("CREATE TRIGGER fail_writes BEFORE UPDATE ON employees BEGIN SELECT RAISE(ABORT, 'locked'); END")
+        conn.execute("CREATE TRIGGER fail_deletes BEFORE DELETE ON employees BEGIN SELECT RAISE(ABORT, 'locked'); END")
+
+    with pytest.raises(sqlite3.Error):
+        db.upsert_employees([ROW[:1] + ("Иван Сидоров",) + ROW[2:]])
+    with pytest.raises(sqlite3.Error):
+        db.delete_employees([1])
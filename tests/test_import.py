@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from app import services
+
+
+def redmine_user(user_id: int, city: str) -> dict:
+    return {'user': {'id': user_id, 'firstname': "Сотрудник", 'lastname': str(user_id), 'status': 1,
+                     'mail': f"user{user_id}@futuretoday.ru", 'updated_on': f"2024-01-0{user_id}T00:00:00Z",
+                     'custom_fields': [{'name': 'Город проживания', 'value': city}]}}
+
+
+def marker_cities() -> set:
+    return {marker['city'] for marker in services.get_map_markers()}
+
+
+def test_failed_import_keeps_saved_batches_on_map(db, fake_redis, monkeypatch):
+    async def fetch_user(client, user_id):
+        if user_id == 3:
+            raise RuntimeError("Redmine недоступен")
+        return 200, redmine_user(user_id, "Казань")
+
+    monkeypatch.setattr(services, 'fetch_user', fetch_user)
+    monkeypatch.setattr(services, 'DB_BATCH_SIZE', 2)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(services.process_users(1, 4, 'import-1', concurrency=1))
+    assert db.get_import_job('import-1')['last_id'] == 2
+    assert marker_cities() == {"Казань"}
+
+
+def test_failed_sync_keeps_saved_pages_on_map(db, fake_redis, monkeypatch):
+    async def list_users(client, params=None, on_page=None):
+        await on_page([redmine_user(1, "Казань")['user']], 2)
+        raise RuntimeError("Redmine недоступен")
+
+    monkeypatch.setattr(services, 'list_users', list_users)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(services.sync_users('sync-1', incremental=True))
+    assert db.get_sync_state(services.USERS_HIGH_WATER_MARK) is None
+    assert marker_cities() == {"Казань"}
@@ -0,0 +1,38 @@
+import asyncio
+import gzip
+import json
+
+import httpx
+
+from app import services
+from app.main import app
+
+CLUSTERS = "/map_clusters?bbox=40,20,70,60&zoom=4"
+
+
+async def get(path: str, **headers) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.get(path, headers=headers)
+
+
+def test_map_clusters_etag_and_encoding(db, fake_redis):
+    db.upsert_employees([(1, "Иван Петров", "user1@futuretoday.ru", "Казань", None, None, "Казань")])
+    asyncio.run(services.update_map_data_cache())
+
+    response = asyncio.run(get(CLUSTERS, **{'accept-encoding': 'gzip'}))
+    assert response.headers['content-encoding'] == 'gzip'
+    etag = response.headers['etag']
+    assert [cluster['count'] for cluster in response.json()] == [1]
+    assert json.loads(gzip.decompress(services.get_map_clusters_payload(4, 40, 20, 70, 60)['gzip'])) == response.json()
+
+    assert asyncio.run(get(CLUSTERS, **{'if-none-match': etag})).status_code == 304
+    # Другая область — другой ответ
+    assert asyncio.run(get("/map_clusters?bbox=40,20,70,61&zoom=4", **{'if-none-match': etag})).status_code == 200
+
+    # Карта изменилась — старый ETag больше не подходит
+    db.upsert_employees([(2, "Пётр Иванов", "user2@futuretoday.ru", "Казань", None, None, "Казань")])
+    asyncio.run(services.update_map_data_cache())
+    response = asyncio.run(get(CLUSTERS, **{'if-none-match': etag}))
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert [cluster['count'] for cluster in response.json()] == [2]
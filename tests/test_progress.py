@@ -0,0 +1,34 @@
+import asyncio
+import json
+
+import httpx
+
+from app.main import app
+from app.progress import load_progress, progress_events, save_progress
+
+
+async def admin_post(path: str) -> dict:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post(path)
+        return response.json()
+
+
+async def first_event(task_id: str) -> dict:
+    events = progress_events(task_id)
+    try:
+        event = await events.__anext__()
+    finally:
+        await events.aclose()
+    return json.loads(event.removeprefix("data: "))
+
+
+def test_resume_resets_failed_progress(db, fake_redis):
+    db.create_import_job('import-1', 1, 10)
+    db.set_import_job_status('import-1', 'failed', "database is locked")
+    save_progress('import-1', {'progress': 5, 'status': 'running', 'error': True, 'message': "database is locked"})
+
+    assert asyncio.run(admin_post("/resume_import/import-1"))['status'] == 'success'
+    progress = load_progress('import-1')
+    assert progress['error'] is None and progress['status'] == 'running'
+    # Поток событий не закрывается на устаревшей ошибке
+    assert asyncio.run(first_event('import-1'))['error'] is None
@@ -0,0 +1,22 @@
+import pytest
+
+from app.ratelimit import RateLimiter, limiter_stats
+
+
+def test_budget_is_shared_between_processes(fake_redis):
+    # Два лимитера одного хоста — как в процессе API и в воркере
+    api, worker = RateLimiter("example.org", 10), RateLimiter("example.org", 10)
+    waits = [limiter._reserve() for limiter in (api, worker) for _ in range(5)]
+    assert max(waits) == 0
+    # Запас из десяти токенов на двоих исчерпан: с отдельными бюджетами у каждого осталось бы ещё по пять
+    assert worker._reserve() == pytest.approx(0.1, abs=0.05)
+
+
+def test_throttle_is_visible_from_any_process(fake_redis):
+    RateLimiter("example.org", 10).on_throttle(429, retry_after=30)
+
+    stats = limiter_stats()
+    host = stats['hosts']['example.org']
+    assert host['rate'] == 5 and host['throttled_count'] == 1 and 29 < host['blocked_for'] <= 30
+    assert [event['status'] for event in stats['events']] == [429]
+    assert RateLimiter("example.org", 10)._reserve() > 29
@@ -0,0 +1,30 @@
+from app.gazetteer import lookup_city
+
+
+def add_employee(db, user_id, name, city_id):
+    db.upsert_employees([(user_id, name, f"user{user_id}@futuretoday.ru", city_id, None, None, city_id)])
+
+
+def test_search_returns_gazetteer_coordinates(db):
+    """Город есть только в справочнике: в city_coordinates его нет, координаты всё равно находятся"""
+    add_employee(db, 1, "Иван Петров", "Санкт-Петербург")
+    assert "Санкт-Петербург" not in db.load_city_coordinates()
+
+    [employee] = db.search_employees("Петров")
+    assert employee['coordinates'] == lookup_city("Санкт-Петербург")
+
+
+def test_search_prefers_override_and_falls_back_to_geocoder(db):
+    add_employee(db, 1, "Анна Смирнова", "Санкт-Петербург")
+    add_employee(db, 2, "Олег Смирнов", "Нигденебывальск")
+    db.save_city_coordinates("Санкт-Петербург", [1.0, 2.0], 'override', is_override=True)
+    db.save_city_coordinates("Нигденебывальск", [3.0, 4.0], 'nominatim')
+
+    coordinates = {employee['id']: employee['coordinates'] for employee in db.search_employees("Смирнов")}
+    assert coordinates == {1: [1.0, 2.0], 2: [3.0, 4.0]}
+
+
+def test_search_without_coordinates(db):
+    add_employee(db, 1, "Пётр Сидоров", "Нигденебывальск")
+    [employee] = db.search_employees("Сидоров")
+    assert employee['coordinates'] is None
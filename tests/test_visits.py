@@ -0,0 +1,56 @@
+import asyncio
+
+from app import visits
+from app.visits import VisitRecorder
+
+
+def count_visits(db) -> int:
+    return db.get_total_visits('2000-01-01', '2100-01-01')
+
+
+def test_stop_writes_buffered_visits(db):
+    async def scenario():
+        recorder = VisitRecorder(batch_size=10, interval=60)
+        recorder.start()
+        for i in range(25):
+            recorder.record(f"visitor{i}")
+        await recorder.stop()
+        return recorder
+
+    recorder = asyncio.run(scenario())
+    assert not recorder.buffer
+    assert count_visits(db) == 25
+
+
+def test_failed_batch_returns_to_buffer(db, monkeypatch):
+    failures = []
+
+    def record_visits(batch):
+        if not failures:
+            failures.append(batch)
+            raise RuntimeError("database is locked")
+        db.record_visits(batch)
+
+    monkeypatch.setattr(visits, 'record_visits', record_visits)
+
+    async def scenario():
+        recorder = VisitRecorder(batch_size=10, interval=60)
+        for i in range(5):
+            recorder.record(f"visitor{i}")
+        try:
+            await recorder.flush()
+        except RuntimeError:
+            pass
+        assert [visit[0] for visit in recorder.buffer] == [f"visitor{i}" for i in range(5)]
+        await recorder.stop()
+
+    asyncio.run(scenario())
+    assert count_visits(db) == 5
+
+
+def test_returned_batch_drops_oldest_when_buffer_is_full():
+    recorder = VisitRecorder(batch_size=3, interval=60, buffer_size=4)
+    recorder.buffer.extend([("new1", ""), ("new2", ""), ("new3", "")])
+    recorder._return_batch([("old1", ""), ("old2", ""), ("old3", "")])
+    assert [visit[0] for visit in recorder.buffer] == ["old3", "new1", "new2", "new3"]
+    assert recorder.dropped == 2